@@ -13,18 +13,34 @@ mail = Mail()
 bcrypt = Bcrypt()
 socketio = SocketIO()
 
-# Update the create_app function to create tables before initializing achievements
-
 def create_app(config_class=Config):
     app = Flask(__name__)
     app.config.from_object(config_class)
 
+    # Pool sizing and SQLite pragmas come from DATABASE_PROFILE
+    from app.utils.database import engine_options, configure_database
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        **engine_options(app.config), **app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {})
+    }
+    
     # Initialize extensions
     db.init_app(app)
+    configure_database(app)
+    
+    # Query counts and SQL time per endpoint and Socket.IO event
+    from app.utils.request_metrics import request_metrics
+    request_metrics.init_app(app)
+    
+    # Cached pages and template fragments, invalidated by tag on commit
+    from app.utils.page_cache import page_cache
+    page_cache.init_app(app)
     login_manager.init_app(app)
     mail.init_app(app)
     bcrypt.init_app(app)
-    socketio.init_app(app)
+    
+    # Share emits and rooms between workers through the configured message queue
+    from app.utils.socket_queue import socketio_options
+    socketio.init_app(app, **socketio_options(app))
     
     # Register blueprints
     from app.main import bp as main_bp
@@ -46,11 +62,11 @@ def create_app(config_class=Config):
     
     # Import and register the chat socket events
     from app.chat import events
+    request_metrics.instrument_socketio(socketio)
     
-    # Create database tables and initialize green achievements
-    with app.app_context():
-        db.create_all()  # Create all tables first
-        from app.green.routes import init_achievements
-        init_achievements()
+    # Schema changes and seed data are applied with `flask db init`, not on boot
+    from app.commands import db_cli, bench_startup
+    app.cli.add_command(db_cli)
+    app.cli.add_command(bench_startup)
     
     return app
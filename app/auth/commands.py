@@ -0,0 +1,38 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+import click
+from flask import current_app
+from app.auth import bp
+from app.utils.passwords import DEFAULT_COSTS, hash_password, hash_settings, verify_password
+
+@bp.cli.command('bench-hash')
+@click.option('--method', type=click.Choice(sorted(DEFAULT_COSTS)),
+              help='Hash method to benchmark. Defaults to PASSWORD_HASH_METHOD.')
+@click.option('--cost', 'costs', type=int, multiple=True,
+              help='Cost setting to try; repeat for several. Defaults to the configured cost.')
+@click.option('--logins', default=50, show_default=True,
+              help='Password checks per cost setting.')
+@click.option('--concurrency', default=8, show_default=True,
+              help='Simultaneous logins, like request threads during a login storm.')
+def bench_hash(method, costs, logins, concurrency):
+    """Measure login throughput (password checks per second) per cost setting."""
+    configured_method, configured_cost = hash_settings()
+    method = method or configured_method
+    costs = costs or [configured_cost if method == configured_method else DEFAULT_COSTS[method]]
+    app = current_app._get_current_object()
+
+    def login(password_hash):
+        with app.app_context():
+            return verify_password(password_hash, 'correct horse battery staple')
+
+    click.echo(f'{method}, {logins} logins, {concurrency} at a time, '
+               f'{app.config["PASSWORD_HASH_WORKERS"]} hashing workers')
+    for cost in costs:
+        password_hash = hash_password('correct horse battery staple', method, cost)
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(login, [password_hash] * logins))
+        elapsed = time.perf_counter() - started
+        if not all(results):
+            raise click.ClickException(f'Verification failed at cost {cost}')
+        click.echo(f'cost {cost:>8}: {logins / elapsed:8.1f} logins/sec')
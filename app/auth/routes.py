@@ -36,6 +36,12 @@ def login():
         if user is None or not user.check_password(form.password.data):
             flash('Invalid email or password', 'danger')
             return redirect(url_for('auth.login'))
+        
+        # Upgrade the stored hash while the plain password is at hand
+        if user.password_needs_rehash():
+            user.set_password(form.password.data)
+            db.session.commit()
+        
         login_user(user)
         next_page = request.args.get('next')
         return redirect(next_page) if next_page else redirect(url_for('main.index'))
@@ -1,11 +1,112 @@
-from flask import request
-from flask_socketio import emit, join_room, leave_room
+from flask import request, session, url_for, current_app
+from flask_socketio import emit, join_room, leave_room, rooms
 from flask_login import current_user
+from sqlalchemy import event, inspect, update
+from sqlalchemy.orm import Session, object_session
 from app import socketio, db
 from app.models.message import Message
-from app.models.ride import RideRequest
+from app.models.notification import Notification
+from app.models.ride import Ride, RideRequest
 from app.models.user import User
+from app.chat.writer import message_writer
+from app.chat.tracking import location_tracker, tracking_room
+from app.utils.read_state import mark_read, get_unread_total, push_unread_count
+from app.utils.user_cache import load_cached_user
 from datetime import datetime
+from uuid import uuid4
+
+@socketio.on('connect')
+def on_connect():
+    # Load the user now so their snapshot is pinned on the connection session
+    # and later events reuse it instead of loading it again (load_cached_user
+    # pins it because this runs in a socket event)
+    user_id = session.get('_user_id')
+    if user_id is not None:
+        load_cached_user(int(user_id))
+
+def chat_room(request_id):
+    return f'chat_{request_id}'
+
+def _parse_chat_room(room, kind='chat'):
+    """Get the ride request id from a chat (or tracking) room name, or None"""
+    prefix, _, request_id = str(room).partition('_')
+    if prefix != kind or not request_id.isdigit():
+        return None
+    return int(request_id)
+
+def resolve_chat_access(request_id):
+    """
+    Check that the current user takes part in a ride request's chat and
+    cache the result on the connection session: the request status and
+    the other participant's id. Returns the cached entry, or None if the
+    user is not a participant.
+    """
+    row = db.session.query(
+        RideRequest.traveler_id, RideRequest.status, Ride.rider_id
+    ).join(Ride, Ride.id == RideRequest.ride_id).filter(
+        RideRequest.id == request_id
+    ).first()
+    if row is None or current_user.id not in (row.traveler_id, row.rider_id):
+        return None
+    
+    access = {
+        'status': row.status,
+        'is_rider': current_user.id == row.rider_id,
+        'peer_id': row.rider_id if current_user.id == row.traveler_id else row.traveler_id
+    }
+    chat_access = session.get('chat_access', {})
+    chat_access[str(request_id)] = access
+    session['chat_access'] = chat_access
+    return access
+
+def get_chat_access(request_id, room=None):
+    """
+    Get the cached access entry for a chat (or tracking) room the
+    connection has joined. Membership is dropped when the request changes
+    status, so a missing room means the client has to join again first.
+    """
+    if (room or chat_room(request_id)) not in rooms():
+        return None
+    return session.get('chat_access', {}).get(str(request_id))
+
+def forget_chat_access(request_id):
+    chat_access = session.get('chat_access', {})
+    if chat_access.pop(str(request_id), None) is not None:
+        session['chat_access'] = chat_access
+
+@event.listens_for(RideRequest, 'after_update')
+def _ride_request_updated(mapper, connection, target):
+    if inspect(target).attrs.status.history.has_changes():
+        # Keep the path of a completed trip, downsampled, on the request. The
+        # path stays in memory until after_commit in case this is rolled back
+        if target.status == 'completed':
+            route = location_tracker.encode_route(target.id)
+            if route:
+                connection.execute(
+                    update(RideRequest.__table__).where(
+                        RideRequest.id == target.id
+                    ).values(route_polyline=route)
+                )
+        
+        # Tell the rooms only once the new status is committed
+        session = object_session(target)
+        if session is not None:
+            session.info.setdefault('chat_access_changes', {})[target.id] = target.status
+
+@event.listens_for(Session, 'after_commit')
+def _chat_access_committed(session):
+    # A status change can grant or revoke chat access: close the room so every
+    # connection, on any worker, has to join and be authorized again
+    for request_id, status in session.info.pop('chat_access_changes', {}).items():
+        for room in (chat_room(request_id), tracking_room(request_id)):
+            socketio.emit('chat_access_changed', {'request_id': request_id, 'status': status},
+                          room=room, namespace='/')
+            socketio.close_room(room, namespace='/')
+        location_tracker.clear(request_id)
+
+@event.listens_for(Session, 'after_rollback')
+def _chat_access_rolled_back(session):
+    session.info.pop('chat_access_changes', None)
 
 @socketio.on('join')
 def on_join(data):
@@ -13,6 +114,10 @@ def on_join(data):
         return
     
     room = data['room']
+    request_id = _parse_chat_room(room)
+    if request_id is None or resolve_chat_access(request_id) is None:
+        return
+    
     join_room(room)
     emit('status', {'msg': f'{current_user.username} has joined the chat'}, room=room)
 
@@ -22,9 +127,105 @@ def on_leave(data):
         return
     
     room = data['room']
+    if room not in rooms():
+        return
+    
     leave_room(room)
+    forget_chat_access(_parse_chat_room(room))
     emit('status', {'msg': f'{current_user.username} has left the chat'}, room=room)
 
+def _parse_position(data):
+    """Get a valid (lat, lng) pair from an update_location payload, or None"""
+    try:
+        lat, lng = float(data['lat']), float(data['lng'])
+    except (KeyError, TypeError, ValueError):
+        return None
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return None
+    return lat, lng
+
+@socketio.on('join_tracking_room')
+def on_join_tracking_room(data):
+    if not current_user.is_authenticated:
+        return
+    
+    request_id = data.get('request_id')
+    if not isinstance(request_id, int):
+        return
+    
+    # Tracking is only available for accepted requests
+    access = resolve_chat_access(request_id)
+    if access is None or access['status'] != 'accepted':
+        return
+    
+    join_room(tracking_room(request_id))
+    
+    # Show the other participant's last known position straight away
+    position = location_tracker.get_positions(request_id).get(access['peer_id'])
+    if position:
+        emit('location_update', {'user_id': access['peer_id'], 'lat': position[0], 'lng': position[1]})
+
+@socketio.on('update_location')
+def on_update_location(data):
+    if not current_user.is_authenticated:
+        return
+    
+    request_id = data.get('request_id')
+    access = get_chat_access(request_id, tracking_room(request_id))
+    if access is None:
+        return
+    
+    position = _parse_position(data)
+    if position is None:
+        return
+    
+    # Throttled and coalesced; the tracker broadcasts to the room
+    # The rider's positions make up the trip's recorded path
+    location_tracker.update(current_app._get_current_object(), request_id,
+                            current_user.id, position[0], position[1], request.sid,
+                            record=access['is_rider'])
+
+@socketio.on('rider_arrived')
+def on_rider_arrived(data):
+    if not current_user.is_authenticated:
+        return
+    
+    request_id = data.get('request_id')
+    access = get_chat_access(request_id, tracking_room(request_id))
+    if access is None or not access['is_rider']:
+        return
+    
+    emit('rider_arrived', {'request_id': request_id}, room=tracking_room(request_id), include_self=False)
+
+@socketio.on('leave_tracking_room')
+def on_leave_tracking_room(data):
+    if not current_user.is_authenticated:
+        return
+    
+    request_id = data.get('request_id')
+    room = tracking_room(request_id)
+    if room not in rooms():
+        return
+    
+    leave_room(room)
+    location_tracker.discard(request_id, current_user.id)
+
+@socketio.on('disconnect')
+def on_disconnect():
+    if not current_user.is_authenticated:
+        return
+    
+    # Forget this connection's live position in every room it was tracking,
+    # and the whole request once no connection is left tracking it
+    for room in rooms():
+        request_id = _parse_chat_room(room, 'tracking')
+        if request_id is None:
+            continue
+        location_tracker.discard(request_id, current_user.id)
+        if not any(sid != request.sid for sid, _ in
+                   socketio.server.manager.get_participants('/', room)):
+            location_tracker.clear(request_id)
+
 @socketio.on('join_notification_room')
 def on_join_notification_room(data):
     if not current_user.is_authenticated:
@@ -35,6 +236,23 @@ def on_join_notification_room(data):
     if user_id and user_id == current_user.id:
         room = f'user_{user_id}_notifications'
         join_room(room)
+        
+        # Send the current unread count so the page does not need to poll for it
+        emit('unread_count', {'unread_count': get_unread_total(user_id)})
+
+@socketio.on('mark_read')
+def on_mark_read(data):
+    if not current_user.is_authenticated:
+        return
+    
+    # Only participants that joined the chat have a read watermark
+    request_id = data.get('request_id')
+    if get_chat_access(request_id) is None:
+        return
+    
+    if mark_read(request_id, current_user.id, data.get('message_id')):
+        db.session.commit()
+        push_unread_count(current_user.id)
 
 @socketio.on('message')
 def handle_message(data):
@@ -44,17 +262,32 @@ def handle_message(data):
     request_id = data['request_id']
     content = data['message']
     
-    # Validate the request
-    ride_request = RideRequest.query.get(request_id)
-    if not ride_request:
+    # Access was checked when the connection joined the chat room
+    access = get_chat_access(request_id)
+    if access is None:
         return
     
-    # Check if user is authorized
-    if current_user.id != ride_request.ride.rider_id and current_user.id != ride_request.traveler_id:
+    # Check if the request is accepted
+    if access['status'] != 'accepted':
         return
     
-    # Check if the request is accepted
-    if ride_request.status != 'accepted':
+    recipient_id = access['peer_id']
+    
+    # Write-behind mode: acknowledge now, store with the next batch
+    if current_app.config.get('CHAT_WRITE_BEHIND'):
+        provisional_id = data.get('client_id') or uuid4().hex
+        message_writer.enqueue(current_app._get_current_object(), {
+            'provisional_id': provisional_id,
+            'ride_request_id': request_id,
+            'sender_id': current_user.id,
+            'sender_name': current_user.username,
+            'recipient_id': recipient_id,
+            'content': content,
+            'sid': request.sid,
+            'link': url_for('chat.chat', request_id=request_id),
+            'created_at': datetime.utcnow()
+        })
+        emit('message_queued', {'provisional_id': provisional_id})
         return
     
     # Create and save the message
@@ -63,11 +296,27 @@ def handle_message(data):
         sender_id=current_user.id,
         content=content
     )
+    message.recipient_id = recipient_id
     db.session.add(message)
+    db.session.flush()
+    
+    # Write the recipient's inbox entry in the same transaction, tied to the
+    # message so opening the chat marks it read
+    db.session.add(Notification(
+        user_id=recipient_id,
+        type='message',
+        message=f'New message from {current_user.username}',
+        icon='fa-comment-alt',
+        link=url_for('chat.chat', request_id=request_id),
+        sender_name=current_user.username,
+        ride_request_id=request_id,
+        message_id=message.id,
+        created_at=message.created_at
+    ))
     db.session.commit()
     
     # Broadcast the message to the chat room
-    room = f'chat_{request_id}'
+    room = chat_room(request_id)
     emit('message', {
         'id': message.id,
         'sender_id': message.sender_id,
@@ -80,12 +329,12 @@ def handle_message(data):
     
     # Send confirmation to sender
     emit('message_sent', {
+        'provisional_id': data.get('client_id'),
         'id': message.id,
         'created_at': message.created_at.strftime('%Y-%m-%d %H:%M:%S')
     })
     
     # Send notification to the recipient
-    recipient_id = ride_request.traveler_id if current_user.id == ride_request.ride.rider_id else ride_request.ride.rider_id
     notification_room = f'user_{recipient_id}_notifications'
     
     emit('new_message_notification', {
@@ -95,3 +344,6 @@ def handle_message(data):
         'timestamp': datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
         'content_preview': content[:50] + ('...' if len(content) > 50 else '')
     }, room=notification_room)
+    
+    # The recipient's counter was incremented when the message was stored
+    push_unread_count(recipient_id)
@@ -3,8 +3,46 @@ from flask_login import current_user, login_required
 from app.chat import bp
 from app.models.ride import RideRequest, Ride
 from app.models.message import Message
+from app.models.notification import Notification
 from app import db, socketio
 from datetime import datetime
+from sqlalchemy.orm import joinedload
+from app.utils.read_state import (get_last_read, mark_read,
+                                  get_unread_count as count_unread, get_unread_counts,
+                                  get_unread_total, push_unread_count)
+
+# Number of messages served per page of chat history
+CHAT_PAGE_SIZE = 30
+
+def get_message_page(request_id, before_id=None, limit=CHAT_PAGE_SIZE):
+    """
+    Get a page of chat messages newest first, with senders eager-loaded.
+    Returns the messages and the before_id cursor for the next older page.
+    """
+    query = Message.query.filter_by(ride_request_id=request_id).options(
+        joinedload(Message.sender)
+    )
+    if before_id:
+        query = query.filter(Message.id < before_id)
+    
+    messages = query.order_by(Message.id.desc()).limit(limit + 1).all()
+    next_before_id = messages[limit - 1].id if len(messages) > limit else None
+    return messages[:limit], next_before_id
+
+def serialize_message(message, peer_last_read=0):
+    """
+    Convert a message to the JSON shape used by the chat API.
+    A message is read once it is at or below the recipient's read watermark.
+    """
+    return {
+        'id': message.id,
+        'sender_id': message.sender_id,
+        'sender_name': message.sender.username,
+        'content': message.content,
+        'created_at': message.created_at.strftime('%Y-%m-%d %H:%M:%S'),
+        'is_read': message.id <= peer_last_read,
+        'is_mine': message.sender_id == current_user.id
+    }
 
 # Update any references to ride_request.messages to use ride_request.chat_messages instead
 
@@ -27,26 +65,26 @@ def chat(request_id):
     # Get the other user (the one who is not the current user)
     other_user = ride.rider if current_user.id == ride_request.traveler_id else ride_request.traveler
     
-    # Get all messages for this ride request
-    messages = Message.query.filter_by(ride_request_id=request_id).order_by(Message.created_at).all()
+    # Mark the conversation read by moving the read watermark
+    if mark_read(request_id, current_user.id):
+        db.session.commit()
+        push_unread_count(current_user.id)
     
-    # Mark unread messages as read
-    unread_messages = Message.query.filter_by(
-        ride_request_id=request_id,
-        is_read=False
-    ).filter(Message.sender_id != current_user.id).all()
+    # Get the latest page of messages; older pages are fetched on scroll
+    messages, next_before_id = get_message_page(request_id)
+    messages.reverse()
     
-    for message in unread_messages:
-        message.is_read = True
-    
-    db.session.commit()
+    # Messages up to the other user's watermark have been read by them
+    peer_last_read = get_last_read(request_id, other_user.id)
     
     return render_template('chat/chat.html', 
                           title='Chat',
                           ride_request=ride_request,
                           ride=ride,
                           other_user=other_user,
-                          messages=messages)
+                          messages=messages,
+                          next_before_id=next_before_id,
+                          peer_last_read=peer_last_read)
 
 @bp.route('/api/messages/<int:request_id>', methods=['GET'])
 @login_required
@@ -57,17 +95,27 @@ def get_messages(request_id):
     if current_user.id != ride_request.ride.rider_id and current_user.id != ride_request.traveler_id:
         return jsonify({'error': 'Unauthorized'}), 403
     
-    messages = Message.query.filter_by(ride_request_id=request_id).order_by(Message.created_at).all()
+    # Serve history newest first, one page per request
+    before_id = request.args.get('before_id', type=int)
+    limit = min(request.args.get('limit', CHAT_PAGE_SIZE, type=int), 100)
+    messages, next_before_id = get_message_page(request_id, before_id=before_id, limit=max(limit, 1))
     
-    return jsonify([{
-        'id': message.id,
-        'sender_id': message.sender_id,
-        'sender_name': message.sender.username,
-        'content': message.content,
-        'created_at': message.created_at.strftime('%Y-%m-%d %H:%M:%S'),
-        'is_read': message.is_read,
-        'is_mine': message.sender_id == current_user.id
-    } for message in messages])
+    peer_id = ride_request.traveler_id if current_user.id == ride_request.ride.rider_id else ride_request.ride.rider_id
+    peer_last_read = get_last_read(request_id, peer_id)
+    
+    return jsonify({
+        'messages': [serialize_message(message, peer_last_read) for message in messages],
+        'next_before_id': next_before_id
+    })
+
+@bp.route('/api/messages/unread', methods=['GET'])
+@login_required
+def get_unread_counts_batch():
+    # Unread counts for all of the user's ride requests in one grouped query
+    unread_counts = get_unread_counts(current_user.id)
+    
+    return jsonify({'unread_counts': {str(request_id): count
+                                      for request_id, count in unread_counts.items()}})
 
 @bp.route('/api/messages/<int:request_id>/unread', methods=['GET'])
 @login_required
@@ -78,10 +126,8 @@ def get_unread_count(request_id):
     if current_user.id != ride_request.ride.rider_id and current_user.id != ride_request.traveler_id:
         return jsonify({'error': 'Unauthorized'}), 403
     
-    unread_count = Message.query.filter_by(
-        ride_request_id=request_id,
-        is_read=False
-    ).filter(Message.sender_id != current_user.id).count()
+    # Messages above the user's read watermark
+    unread_count = count_unread(request_id, current_user.id)
     
     return jsonify({'unread_count': unread_count})
 
@@ -90,35 +136,22 @@ def get_unread_count(request_id):
 @bp.route('/api/notifications/unread')
 @login_required
 def get_unread_notifications():
-    # Get all unread messages across all ride requests
-    unread_count = Message.query.join(RideRequest).filter(
-        ((RideRequest.traveler_id == current_user.id) & (Message.sender_id != current_user.id)) |
-        ((RideRequest.ride.has(Ride.rider_id == current_user.id)) & (Message.sender_id != current_user.id))
-    ).filter(Message.is_read == False).count()
-    
-    return jsonify({'unread_count': unread_count})
+    # Read the maintained per-user unread counter
+    return jsonify({'unread_count': get_unread_total(current_user.id)})
 
 @bp.route('/api/notifications')
 @login_required
 def get_notifications():
-    # Get recent unread messages
-    unread_messages = Message.query.join(RideRequest).filter(
-        ((RideRequest.traveler_id == current_user.id) & (Message.sender_id != current_user.id)) |
-        ((RideRequest.ride.has(Ride.rider_id == current_user.id)) & (Message.sender_id != current_user.id))
-    ).filter(Message.is_read == False).order_by(Message.created_at.desc()).limit(5).all()
-    
-    notifications = []
-    for message in unread_messages:
-        ride_request = message.ride_request
-        sender = User.query.get(message.sender_id)
-        
-        notifications.append({
-            'id': message.id,
-            'type': 'message',
-            'text': f'New message from {sender.username}',
-            'link': url_for('chat.chat', request_id=ride_request.id),
-            'timestamp': message.created_at.strftime('%Y-%m-%d %H:%M:%S'),
-            'icon': 'fa-comment-alt'
-        })
-    
-    return jsonify({'notifications': notifications})
\ No newline at end of file
+    # Newest unread inbox entries, stored ready to display
+    notifications = Notification.query.filter_by(user_id=current_user.id, is_read=False).order_by(
+        Notification.created_at.desc()
+    ).limit(5).all()
+    
+    return jsonify({'notifications': [{
+        'id': notification.id,
+        'type': notification.type,
+        'text': notification.message,
+        'link': notification.link,
+        'timestamp': notification.created_at.strftime('%Y-%m-%d %H:%M:%S'),
+        'icon': notification.icon
+    } for notification in notifications]})
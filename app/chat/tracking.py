@@ -0,0 +1,133 @@
+import time
+from threading import Lock
+from app import socketio
+from app.utils.distance import calculate_distance
+from app.utils.route_history import LocationHistory, simplify, encode_polyline
+
+def tracking_room(request_id):
+    return f'tracking_{request_id}'
+
+class LocationTracker:
+    """
+    In-memory live positions for ride requests being tracked.
+
+    Keeps the latest accepted position of each participant. An update is
+    dropped if the same sender's last accepted update was less than
+    min_interval seconds ago or moved less than min_distance metres.
+    Accepted updates are not emitted right away: they replace any pending
+    update from the same sender, and one background task broadcasts the
+    pending updates of every room at most broadcasts_per_second times per
+    second. Nothing is written to the database while the trip is live;
+    the rider's accepted positions are kept in a bounded, self-simplifying
+    buffer per request and turned into a polyline when the trip completes.
+    A participant's state is discarded when their socket disconnects, and
+    the whole request's, path included, once nobody is tracking it.
+    """
+
+    def __init__(self, min_interval=1.0, min_distance=20, broadcasts_per_second=2,
+                 history_size=2048, simplify_tolerance=10):
+        self.min_interval = min_interval
+        self.min_distance = min_distance
+        self.broadcasts_per_second = broadcasts_per_second
+        self.history_size = history_size
+        self.simplify_tolerance = simplify_tolerance
+        # request_id -> {user_id: (lat, lng, timestamp)}
+        self._positions = {}
+        # request_id -> {user_id: (lat, lng, sid)}
+        self._pending = {}
+        # request_id -> LocationHistory of the rider's path
+        self._history = {}
+        self._lock = Lock()
+        self._task = None
+
+    def configure(self, app):
+        self.min_interval = app.config.get('TRACKING_MIN_INTERVAL', self.min_interval)
+        self.min_distance = app.config.get('TRACKING_MIN_DISTANCE', self.min_distance)
+        self.broadcasts_per_second = app.config.get('TRACKING_BROADCASTS_PER_SECOND',
+                                                    self.broadcasts_per_second)
+        self.history_size = app.config.get('TRACKING_HISTORY_SIZE', self.history_size)
+        self.simplify_tolerance = app.config.get('TRACKING_SIMPLIFY_TOLERANCE',
+                                                 self.simplify_tolerance)
+
+    def update(self, app, request_id, user_id, lat, lng, sid, record=False):
+        """
+        Record a position; returns False if it was throttled or too small a
+        move. With record=True the position is also added to the trip path.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if self._task is None:
+                self.configure(app)
+                self._task = socketio.start_background_task(self._run)
+
+            last = self._positions.get(request_id, {}).get(user_id)
+            if last is not None:
+                last_lat, last_lng, last_time = last
+                if now - last_time < self.min_interval:
+                    return False
+                if calculate_distance(last_lat, last_lng, lat, lng) * 1000 < self.min_distance:
+                    return False
+
+            self._positions.setdefault(request_id, {})[user_id] = (lat, lng, now)
+            self._pending.setdefault(request_id, {})[user_id] = (lat, lng, sid)
+            if record:
+                history = self._history.get(request_id)
+                if history is None:
+                    history = self._history[request_id] = LocationHistory(
+                        self.history_size, self.simplify_tolerance)
+                history.append(time.time(), lat, lng)
+            return True
+
+    def get_positions(self, request_id):
+        """Get the latest known position of each participant as {user_id: (lat, lng)}"""
+        with self._lock:
+            return {user_id: (lat, lng)
+                    for user_id, (lat, lng, _) in self._positions.get(request_id, {}).items()}
+
+    def discard(self, request_id, user_id):
+        """Forget a participant that stopped sharing their location"""
+        with self._lock:
+            for store in (self._positions, self._pending):
+                positions = store.get(request_id)
+                if positions is not None:
+                    positions.pop(user_id, None)
+                    if not positions:
+                        del store[request_id]
+
+    def clear(self, request_id):
+        """Forget every position of a ride request, e.g. when tracking ends"""
+        with self._lock:
+            self._positions.pop(request_id, None)
+            self._pending.pop(request_id, None)
+            self._history.pop(request_id, None)
+
+    def encode_route(self, request_id):
+        """
+        Get a trip's recorded path downsampled and encoded as a polyline, or
+        None if nothing was recorded. The path is kept until clear().
+        """
+        with self._lock:
+            history = self._history.get(request_id)
+            points = history.points() if history else None
+        if not points:
+            return None
+        return encode_polyline(simplify(points, self.simplify_tolerance))
+
+    def _take_pending(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            return pending
+
+    def _run(self):
+        while True:
+            socketio.sleep(1.0 / self.broadcasts_per_second)
+            for request_id, updates in self._take_pending().items():
+                room = tracking_room(request_id)
+                for user_id, (lat, lng, sid) in updates.items():
+                    socketio.emit('location_update', {
+                        'user_id': user_id,
+                        'lat': lat,
+                        'lng': lng
+                    }, room=room, skip_sid=sid, namespace='/')
+
+location_tracker = LocationTracker()
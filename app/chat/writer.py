@@ -0,0 +1,192 @@
+import atexit
+import queue
+import time
+from threading import Lock
+from app import socketio, db
+from app.models.message import Message
+from app.models.notification import Notification
+from app.utils.read_state import push_unread_count
+
+# Queued by shutdown() to wake the flusher
+_STOP = object()
+
+class MessageBatchWriter:
+    """
+    Write-behind queue for chat messages.
+
+    Messages are acknowledged with a provisional id as soon as they are
+    queued, then stored in batches of at most max_size messages with one
+    commit per batch, at most max_delay seconds after the first message of
+    the batch was queued. The flusher sleeps while the queue is empty.
+    Batches are written in queue order so ids follow send order. After a
+    batch commits each sender gets 'message_sent' with its real id. A
+    failing batch is logged and skipped so the flusher keeps running, and
+    whatever is still queued at interpreter exit is written by shutdown().
+    """
+
+    def __init__(self, max_size=50, max_delay=0.05):
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self._queue = queue.Queue()
+        self._lock = Lock()
+        # Held while a batch is collected and written, so batches (and the
+        # shutdown drain) are written one at a time in queue order
+        self._flush_lock = Lock()
+        self._app = None
+        self._task = None
+        self._stopping = False
+        self._exit_hook = False
+
+    def configure(self, app):
+        self.max_size = app.config.get('CHAT_BATCH_MAX_SIZE', self.max_size)
+        self.max_delay = app.config.get('CHAT_BATCH_MAX_DELAY', self.max_delay)
+
+    def enqueue(self, app, item):
+        """Queue a message; starts the flusher on first use"""
+        with self._lock:
+            self._queue.put(item)
+            if self._task is None and not self._stopping:
+                self._app = app
+                self.configure(app)
+                if not self._exit_hook:
+                    atexit.register(self.shutdown)
+                    self._exit_hook = True
+                self._task = socketio.start_background_task(self._run)
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def _collect(self, batch):
+        """Add queued messages to a batch until it is full or max_delay has passed"""
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is _STOP:
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        try:
+            while not self._stopping:
+                with self._flush_lock:
+                    # Sleep until there is something to write
+                    item = self._queue.get()
+                    if item is _STOP:
+                        break
+                    self._write(self._collect([item]))
+        finally:
+            # Let the next enqueue start a new flusher if this one died
+            with self._lock:
+                self._task = None
+
+    def _write(self, batch):
+        try:
+            with self._app.app_context():
+                self.flush(batch)
+        except Exception:
+            self._app.logger.exception('Chat message batch of %d failed', len(batch))
+
+    def shutdown(self):
+        """Stop the flusher and write everything still queued"""
+        self._stopping = True
+        # Wake the flusher if it is waiting for a message
+        self._queue.put(_STOP)
+        if self._app is None:
+            return
+        with self._flush_lock:
+            batch = []
+            while True:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    continue
+                batch.append(item)
+                if len(batch) == self.max_size:
+                    self._write(batch)
+                    batch = []
+            if batch:
+                self._write(batch)
+
+    def flush(self, batch):
+        """Store a batch in one transaction, then confirm and broadcast it"""
+        messages = []
+        for item in batch:
+            message = Message(
+                ride_request_id=item['ride_request_id'],
+                sender_id=item['sender_id'],
+                content=item['content'],
+                created_at=item['created_at']
+            )
+            message.recipient_id = item['recipient_id']
+            messages.append(message)
+            db.session.add(message)
+
+        try:
+            # Messages first, so each inbox entry can point at its message
+            db.session.flush()
+            for item, message in zip(batch, messages):
+                db.session.add(Notification(
+                    user_id=item['recipient_id'],
+                    type='message',
+                    message=f"New message from {item['sender_name']}",
+                    icon='fa-comment-alt',
+                    link=item['link'],
+                    sender_name=item['sender_name'],
+                    ride_request_id=item['ride_request_id'],
+                    message_id=message.id,
+                    created_at=item['created_at']
+                ))
+            db.session.flush()
+            stored = [(message.id, message.created_at.strftime('%Y-%m-%d %H:%M:%S'))
+                      for message in messages]
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            for item in batch:
+                socketio.emit('message_failed', {'provisional_id': item['provisional_id']},
+                              to=item['sid'])
+            return
+
+        recipients = set()
+        for item, (message_id, created_at) in zip(batch, stored):
+            # Broadcast the message to the chat room
+            socketio.emit('message', {
+                'id': message_id,
+                'sender_id': item['sender_id'],
+                'sender_name': item['sender_name'],
+                'content': item['content'],
+                'created_at': created_at,
+                'is_read': False,
+                'is_mine': False
+            }, room=f"chat_{item['ride_request_id']}", skip_sid=item['sid'])
+
+            # Confirm durability to the sender
+            socketio.emit('message_sent', {
+                'provisional_id': item['provisional_id'],
+                'id': message_id,
+                'created_at': created_at
+            }, to=item['sid'])
+
+            socketio.emit('new_message_notification', {
+                'request_id': item['ride_request_id'],
+                'sender_id': item['sender_id'],
+                'sender_name': item['sender_name'],
+                'timestamp': created_at,
+                'content_preview': item['content'][:50] + ('...' if len(item['content']) > 50 else '')
+            }, room=f"user_{item['recipient_id']}_notifications")
+            recipients.add(item['recipient_id'])
+
+        # One count push per recipient per batch
+        for recipient_id in recipients:
+            push_unread_count(recipient_id)
+
+message_writer = MessageBatchWriter()
@@ -0,0 +1,142 @@
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+from app import db
+from app.utils.database import DATABASE_PROFILES, enable_pragmas, engine_options, sqlite_pragmas
+
+db_cli = AppGroup('db', help='Create, upgrade and seed the database.')
+
+@db_cli.command('upgrade')
+def upgrade():
+    """Create missing tables, columns and indexes and migrate existing data."""
+    from app.utils.schema import add_missing_columns
+    from app.utils.read_state import backfill_notifications, backfill_read_state
+    db.create_all()
+    add_missing_columns()  # Add columns introduced after the tables were created
+    # Chats read before read watermarks existed keep their read state
+    backfilled = backfill_read_state()
+    if backfilled:
+        click.echo(f'Seeded {backfilled} chat read watermarks from read messages.')
+    # Unread messages from before the inbox existed get inbox entries
+    added = backfill_notifications()
+    if added:
+        click.echo(f'Added {added} inbox entries for unread messages.')
+    click.echo('Database schema is up to date.')
+
+@db_cli.command('seed')
+def seed():
+    """Add the default green achievements if there are none."""
+    from app.green.routes import init_achievements
+    init_achievements()
+    click.echo('Default data is in place.')
+
+@db_cli.command('init')
+@click.pass_context
+def init(ctx):
+    """Upgrade the schema and seed default data; safe to run on every deploy."""
+    ctx.invoke(upgrade)
+    ctx.invoke(seed)
+
+def _run_workload(engine, readers, writers, seconds):
+    """Hammer a scratch table from reader and writer threads; returns operation counts"""
+    with engine.begin() as connection:
+        connection.execute(text('CREATE TABLE bench (id INTEGER PRIMARY KEY, room INTEGER, body TEXT)'))
+        connection.execute(text('INSERT INTO bench (room, body) VALUES (:room, :body)'),
+                           [{'room': i % 100, 'body': 'x' * 200} for i in range(5000)])
+
+    counts = {'reads': 0, 'writes': 0, 'errors': 0}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def read():
+        while time.perf_counter() < deadline:
+            try:
+                with engine.connect() as connection:
+                    connection.execute(text('SELECT id, body FROM bench WHERE room = :room ORDER BY id DESC LIMIT 50'),
+                                       {'room': random.randrange(100)}).all()
+                key = 'reads'
+            except OperationalError:
+                key = 'errors'
+            with lock:
+                counts[key] += 1
+
+    def write():
+        while time.perf_counter() < deadline:
+            try:
+                # A chat-sized transaction: a few rows per commit
+                with engine.begin() as connection:
+                    connection.execute(text('INSERT INTO bench (room, body) VALUES (:room, :body)'),
+                                       [{'room': random.randrange(100), 'body': 'y' * 200} for _ in range(5)])
+                key = 'writes'
+            except OperationalError:
+                key = 'errors'
+            with lock:
+                counts[key] += 1
+
+    threads = [threading.Thread(target=read) for _ in range(readers)]
+    threads += [threading.Thread(target=write) for _ in range(writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return counts
+
+@db_cli.command('bench-concurrency')
+@click.option('--readers', default=8, show_default=True, help='Reader threads.')
+@click.option('--writers', default=2, show_default=True, help='Writer threads.')
+@click.option('--seconds', default=3.0, show_default=True, help='Duration per profile.')
+def bench_concurrency(readers, writers, seconds):
+    """Compare read/write throughput of each DATABASE_PROFILE on a scratch SQLite file."""
+    click.echo(f'{readers} readers, {writers} writers, {seconds:g}s per profile')
+    for profile in DATABASE_PROFILES:
+        with tempfile.TemporaryDirectory() as folder:
+            config = dict(current_app.config,
+                          SQLALCHEMY_DATABASE_URI=f'sqlite:///{os.path.join(folder, "bench.db")}')
+            engine = create_engine(config['SQLALCHEMY_DATABASE_URI'], **engine_options(config, profile))
+            enable_pragmas(engine, sqlite_pragmas(config, profile))
+            counts = _run_workload(engine, readers, writers, seconds)
+            engine.dispose()
+        click.echo(f'{profile:>10}: {counts["reads"] / seconds:8.1f} reads/sec, '
+                   f'{counts["writes"] / seconds:7.1f} commits/sec, {counts["errors"]} lock errors')
+
+# Run in a fresh interpreter so nothing is already imported
+_STARTUP_PROBE = '''
+import json, time
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+app.create_app()
+created = time.perf_counter()
+print(json.dumps({'import': imported - started, 'create_app': created - imported}))
+'''
+
+@click.command('bench-startup')
+@click.option('--runs', default=5, show_default=True,
+              help='Cold starts to measure, each in a new Python process.')
+def bench_startup(runs):
+    """Measure cold import and app factory time."""
+    root = os.path.dirname(current_app.root_path)
+    timings = []
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, '-c', _STARTUP_PROBE], cwd=root,
+                                capture_output=True, text=True)
+        if result.returncode != 0:
+            raise click.ClickException(result.stderr.strip().splitlines()[-1])
+        timings.append(json.loads(result.stdout.strip().splitlines()[-1]))
+
+    click.echo(f'{runs} cold starts')
+    for phase in ('import', 'create_app'):
+        values = [timing[phase] * 1000 for timing in timings]
+        click.echo(f'{phase:>10}: median {statistics.median(values):7.1f} ms, '
+                   f'min {min(values):7.1f} ms, max {max(values):7.1f} ms')
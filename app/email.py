@@ -1,15 +1,182 @@
-from threading import Thread
+import atexit
+import queue
+import smtplib
+import time
+from threading import Lock
 from flask import current_app
 from flask_mail import Message
-from app import mail
+from app import mail, socketio
 
-def send_async_email(app, msg):
-    with app.app_context():
-        mail.send(msg)
+class EmailWorkerPool:
+    """
+    Bounded pool of email workers fed from one queue.
+
+    Each worker keeps its SMTP connection open between batches and closes
+    it after idle_timeout seconds without mail. A worker takes up to
+    batch_size queued messages at a time and sends them over the same
+    connection. A failed send is retried with exponential backoff on a
+    fresh connection, up to max_retries times. The queue holds at most
+    max_queue messages; send_email reports False when it is full. At
+    interpreter exit shutdown() sends what is still queued, for at most
+    shutdown_timeout seconds.
+    """
+
+    def __init__(self, workers=2, batch_size=20, max_queue=1000, max_retries=3,
+                 retry_delay=1.0, idle_timeout=30, shutdown_timeout=10):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_queue = max_queue
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.idle_timeout = idle_timeout
+        self.shutdown_timeout = shutdown_timeout
+        self._stopping = False
+        self._queue = None
+        self._app = None
+        self._lock = Lock()
+        self._stats = {'sent': 0, 'retried': 0, 'failed': 0}
+
+    def configure(self, app):
+        self.workers = app.config.get('MAIL_WORKERS', self.workers)
+        self.batch_size = app.config.get('MAIL_BATCH_SIZE', self.batch_size)
+        self.max_queue = app.config.get('MAIL_QUEUE_MAX_SIZE', self.max_queue)
+        self.max_retries = app.config.get('MAIL_MAX_RETRIES', self.max_retries)
+        self.retry_delay = app.config.get('MAIL_RETRY_DELAY', self.retry_delay)
+        self.idle_timeout = app.config.get('MAIL_IDLE_TIMEOUT', self.idle_timeout)
+        self.shutdown_timeout = app.config.get('MAIL_SHUTDOWN_TIMEOUT', self.shutdown_timeout)
+
+    def enqueue(self, app, msg):
+        """Queue a message; starts the workers on first use"""
+        with self._lock:
+            if self._queue is None:
+                self._app = app
+                self.configure(app)
+                self._queue = queue.Queue(maxsize=self.max_queue)
+                atexit.register(self.shutdown)
+                for _ in range(self.workers):
+                    socketio.start_background_task(self._run)
+        try:
+            self._queue.put_nowait(msg)
+            return True
+        except queue.Full:
+            app.logger.error('Email queue full, dropping "%s" to %s', msg.subject, msg.recipients)
+            return False
+
+    def queue_depth(self):
+        """Number of messages waiting for a worker"""
+        return self._queue.qsize() if self._queue else 0
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, queued=self.queue_depth())
+
+    def render_metrics(self):
+        """Queue depth and send totals in the Prometheus text exposition format"""
+        stats = self.stats()
+        lines = ['# HELP rideshare_email_queue_depth Emails waiting for a worker.',
+                 '# TYPE rideshare_email_queue_depth gauge',
+                 f'rideshare_email_queue_depth {stats["queued"]}']
+        for key, metric, description in (
+            ('sent', 'rideshare_email_sent_total', 'Emails sent.'),
+            ('failed', 'rideshare_email_failed_total', 'Emails dropped after the last retry or as unsendable.'),
+            ('retried', 'rideshare_email_retries_total', 'Send attempts retried after an SMTP or network error.'),
+        ):
+            lines += [f'# HELP {metric} {description}', f'# TYPE {metric} counter',
+                      f'{metric} {stats[key]}']
+        return '\n'.join(lines) + '\n'
+
+    def shutdown(self, timeout=None):
+        """Send what is still queued, then wait for the workers, for at most timeout seconds"""
+        if self._queue is None:
+            return
+        self._stopping = True
+        deadline = time.monotonic() + (self.shutdown_timeout if timeout is None else timeout)
+        connection = None
+        with self._app.app_context():
+            while time.monotonic() < deadline:
+                try:
+                    msg = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                connection = self._send(connection, msg)
+                self._queue.task_done()
+            self._close(connection)
+
+            # Messages the workers took are sent in their threads
+            with self._queue.all_tasks_done:
+                while self._queue.unfinished_tasks and time.monotonic() < deadline:
+                    self._queue.all_tasks_done.wait(deadline - time.monotonic())
+                unsent = self._queue.unfinished_tasks
+            if unsent:
+                current_app.logger.error('Exiting with %d emails unsent', unsent)
+
+    def _count(self, key):
+        with self._lock:
+            self._stats[key] += 1
+
+    def _take_batch(self):
+        """Wait for a message, then take whatever else is queued up to batch_size"""
+        try:
+            batch = [self._queue.get(timeout=self.idle_timeout)]
+        except queue.Empty:
+            return []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        connection = None
+        with self._app.app_context():
+            while True:
+                batch = self._take_batch()
+                if not batch:
+                    # Idle: let the SMTP server see a clean QUIT
+                    connection = self._close(connection)
+                    continue
+                for msg in batch:
+                    connection = self._send(connection, msg)
+                    self._queue.task_done()
+
+    def _send(self, connection, msg):
+        """Send one message, reconnecting and backing off on failure"""
+        for attempt in range(self.max_retries + 1):
+            try:
+                if connection is None:
+                    connection = mail.connect().__enter__()
+                connection.send(msg)
+                self._count('sent')
+                return connection
+            except (smtplib.SMTPException, OSError) as e:
+                connection = self._close(connection)
+                # No backoff while shutting down, there is a deadline to keep
+                if attempt == self.max_retries or self._stopping:
+                    self._count('failed')
+                    current_app.logger.error('Giving up on email to %s: %s', msg.recipients, e)
+                    return None
+                self._count('retried')
+                socketio.sleep(self.retry_delay * 2 ** attempt)
+            except Exception:
+                # A message that can never be sent (bad header, no sender): drop
+                # it without retrying and keep the worker running
+                self._count('failed')
+                current_app.logger.exception('Dropping unsendable email to %s', msg.recipients)
+                return self._close(connection)
+
+    def _close(self, connection):
+        if connection is not None:
+            try:
+                connection.__exit__(None, None, None)
+            except (smtplib.SMTPException, OSError):
+                pass
+        return None
+
+email_workers = EmailWorkerPool()
 
 def send_email(subject, sender, recipients, text_body, html_body):
     msg = Message(subject, sender=sender, recipients=recipients)
     msg.body = text_body
     msg.html = html_body
-    Thread(target=send_async_email,
-           args=(current_app._get_current_object(), msg)).start()
+    return email_workers.enqueue(current_app._get_current_object(), msg)
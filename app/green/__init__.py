@@ -2,4 +2,4 @@ from flask import Blueprint
 
 bp = Blueprint('green', __name__)
 
-from app.green import routes
\ No newline at end of file
+from app.green import routes, commands
\ No newline at end of file
@@ -0,0 +1,256 @@
+import json
+import time
+from collections import defaultdict
+from datetime import datetime
+import click
+from sqlalchemy import func, insert, or_, select
+from app import db
+from app.green import bp
+from app.models.green_credits import (GreenCredit, Achievement, UserAchievement,
+                                      CreditRedemption, RecomputeCheckpoint,
+                                      StagedGreenCredit, StagedUserAchievement)
+from app.models.ride import Ride, RideRequest
+from app.models.user import User
+from app.utils.credits import rebuild_balances
+from app.utils.distance import calculate_distance
+from app.utils.green_stats import clear_dashboard_summaries
+from app.utils.page_cache import page_cache
+
+CHECKPOINT_NAME = 'green_recompute'
+
+# Credits per completed ride, per participant (see award_ride_credits)
+RIDE_CREDITS = 10
+
+# Bonus credits per achievement (see check_achievements)
+ACHIEVEMENT_BONUS = 20
+
+def _new_state():
+    return {'carbon': {}, 'rides': {}, 'credits': {}}
+
+def _derived_credits():
+    """Ledger rows the recompute rebuilds; anything else (manual credits) is kept"""
+    return or_(
+        GreenCredit.ride_id.isnot(None),
+        GreenCredit.reason.like('Achievement bonus:%'),
+        GreenCredit.reason.like('Earned achievement:%')
+    )
+
+def _load_checkpoint(restart):
+    """Get the checkpoint row, clearing the staged rows when starting over"""
+    checkpoint = RecomputeCheckpoint.query.get(CHECKPOINT_NAME)
+    if checkpoint and not restart:
+        return checkpoint
+
+    # The live ledger is untouched until the staged rows are swapped in
+    StagedGreenCredit.query.delete(synchronize_session=False)
+    StagedUserAchievement.query.delete(synchronize_session=False)
+
+    if checkpoint is None:
+        checkpoint = RecomputeCheckpoint(name=CHECKPOINT_NAME)
+        db.session.add(checkpoint)
+    checkpoint.phase = 'rides'
+    checkpoint.last_ride_id = 0
+    checkpoint.state = json.dumps(_new_state())
+    db.session.commit()
+    return checkpoint
+
+def _ride_chunks(last_ride_id, chunk_size):
+    """Yield completed rides in primary-key order, one chunk at a time"""
+    while True:
+        rides = db.session.query(
+            Ride.id, Ride.rider_id,
+            Ride.start_latitude, Ride.start_longitude,
+            Ride.end_latitude, Ride.end_longitude
+        ).filter(
+            Ride.status == 'completed',
+            Ride.id > last_ride_id
+        ).order_by(Ride.id).limit(chunk_size).all()
+
+        if not rides:
+            return
+        yield rides
+        last_ride_id = rides[-1].id
+
+def _process_chunk(rides, state):
+    """Compute ride credits for a chunk and accumulate per-user totals"""
+    ride_ids = [ride.id for ride in rides]
+
+    # Completed passengers for every ride in the chunk, with their usernames
+    passengers = defaultdict(list)
+    for ride_id, traveler_id, username in db.session.query(
+        RideRequest.ride_id, RideRequest.traveler_id, User.username
+    ).join(User, User.id == RideRequest.traveler_id).filter(
+        RideRequest.ride_id.in_(ride_ids),
+        RideRequest.status == 'completed'
+    ):
+        passengers[ride_id].append((traveler_id, username))
+
+    # Ride counts and carbon follow the user's role, as in carbon_saved_subquery:
+    # riders are credited for rides they offered, everyone else for rides taken
+    user_ids = {ride.rider_id for ride in rides}
+    user_ids.update(traveler_id for travelers in passengers.values() for traveler_id, _ in travelers)
+    is_rider = {user_id: role == 'rider' for user_id, role in db.session.query(
+        User.id, User.role
+    ).filter(User.id.in_(user_ids))}
+
+    carbon, ride_counts, credits = state['carbon'], state['rides'], state['credits']
+    now = datetime.utcnow()
+    rows = []
+
+    for ride in rides:
+        rider_key = str(ride.rider_id)
+        if is_rider.get(ride.rider_id):
+            ride_counts[rider_key] = ride_counts.get(rider_key, 0) + 1
+
+        travelers = passengers.get(ride.id, [])
+        if not travelers:
+            continue
+
+        distance = calculate_distance(
+            ride.start_latitude, ride.start_longitude,
+            ride.end_latitude, ride.end_longitude
+        )
+        if is_rider.get(ride.rider_id):
+            carbon[rider_key] = carbon.get(rider_key, 0) + round(distance * 0.12 * len(travelers), 2)
+
+        for traveler_id, username in travelers:
+            traveler_key = str(traveler_id)
+            if not is_rider.get(traveler_id):
+                ride_counts[traveler_key] = ride_counts.get(traveler_key, 0) + 1
+                carbon[traveler_key] = carbon.get(traveler_key, 0) + distance * 0.12
+
+            rows.append({'user_id': traveler_id, 'amount': RIDE_CREDITS,
+                         'reason': 'Completed ride as traveler',
+                         'ride_id': ride.id, 'created_at': now})
+            rows.append({'user_id': ride.rider_id, 'amount': RIDE_CREDITS,
+                         'reason': f'Completed ride with {username}',
+                         'ride_id': ride.id, 'created_at': now})
+            credits[traveler_key] = credits.get(traveler_key, 0) + RIDE_CREDITS
+            credits[rider_key] = credits.get(rider_key, 0) + RIDE_CREDITS
+
+    return rows
+
+def _award_achievements(state):
+    """Build achievement and bonus credit rows from the accumulated totals"""
+    redeemed = dict(db.session.query(
+        CreditRedemption.user_id, func.sum(CreditRedemption.amount)
+    ).group_by(CreditRedemption.user_id).all())
+    kept = dict(db.session.query(
+        GreenCredit.user_id, func.sum(GreenCredit.amount)
+    ).filter(~_derived_credits()).group_by(GreenCredit.user_id).all())
+
+    achievements = Achievement.query.order_by(Achievement.id).all()
+    now = datetime.utcnow()
+    achievement_rows, credit_rows = [], []
+
+    user_ids = {int(key) for key in set(state['rides']) | set(state['carbon']) | set(state['credits'])}
+    for user_id in user_ids | set(kept):
+        user_key = str(user_id)
+        # Same total as get_total_credits: the whole ledger, including bonuses
+        # awarded so far, less redemptions
+        totals = {
+            'rides_completed': state['rides'].get(user_key, 0),
+            'carbon_saved': round(state['carbon'].get(user_key, 0), 2),
+            'credits_earned': (state['credits'].get(user_key, 0) + (kept.get(user_id) or 0)
+                               - (redeemed.get(user_id) or 0))
+        }
+        for achievement in achievements:
+            if totals.get(achievement.achievement_type, 0) < achievement.requirement:
+                continue
+            achievement_rows.append({'user_id': user_id, 'achievement_id': achievement.id,
+                                     'earned_at': now})
+            credit_rows.append({'user_id': user_id, 'amount': ACHIEVEMENT_BONUS,
+                                'reason': f'Achievement bonus: {achievement.name}',
+                                'ride_id': None, 'created_at': now})
+            totals['credits_earned'] += ACHIEVEMENT_BONUS
+
+    return achievement_rows, credit_rows
+
+def _swap_in_staged():
+    """Replace the derived ledger rows and achievements with the staged ones"""
+    credit_columns = ['user_id', 'amount', 'reason', 'ride_id', 'created_at']
+    achievement_columns = ['user_id', 'achievement_id', 'earned_at']
+
+    GreenCredit.query.filter(_derived_credits()).delete(synchronize_session=False)
+    UserAchievement.query.delete(synchronize_session=False)
+    db.session.execute(insert(GreenCredit.__table__).from_select(
+        credit_columns, select(*[getattr(StagedGreenCredit, name) for name in credit_columns])
+    ))
+    db.session.execute(insert(UserAchievement.__table__).from_select(
+        achievement_columns, select(*[getattr(StagedUserAchievement, name) for name in achievement_columns])
+    ))
+    StagedGreenCredit.query.delete(synchronize_session=False)
+    StagedUserAchievement.query.delete(synchronize_session=False)
+
+    # The bulk statements skip the ledger hooks, so rebuild what they maintain
+    rebuild_balances()
+
+@bp.cli.command('recompute')
+@click.option('--chunk-size', default=500, show_default=True,
+              help='Number of completed rides processed per batch.')
+@click.option('--restart', is_flag=True,
+              help='Ignore any saved checkpoint and rebuild from the first ride.')
+def recompute(chunk_size, restart):
+    """
+    Rebuild green credits, carbon totals and achievements from completed rides.
+    New rows are staged and replace the derived ones in a single transaction
+    at the end, so the site keeps serving the old ledger until then.
+    """
+    checkpoint = _load_checkpoint(restart)
+    if checkpoint.phase == 'done':
+        click.echo('The last recompute already finished. Use --restart to run it again.')
+        return
+    state = json.loads(checkpoint.state)
+
+    if checkpoint.last_ride_id:
+        click.echo(f'Resuming after ride {checkpoint.last_ride_id} ({checkpoint.phase})')
+
+    started = time.perf_counter()
+    total_rides = total_rows = 0
+
+    if checkpoint.phase == 'rides':
+        for rides in _ride_chunks(checkpoint.last_ride_id, chunk_size):
+            rows = _process_chunk(rides, state)
+            if rows:
+                db.session.execute(insert(StagedGreenCredit), rows)
+
+            # Progress is committed in the same transaction as the rows it covers
+            checkpoint.last_ride_id = rides[-1].id
+            checkpoint.state = json.dumps(state)
+            db.session.commit()
+
+            total_rides += len(rides)
+            total_rows += len(rows)
+            elapsed = time.perf_counter() - started
+            click.echo(f'{total_rides} rides, {total_rows} rows written '
+                       f'({total_rows / elapsed if elapsed else 0:.0f} rows/sec), '
+                       f'last ride {checkpoint.last_ride_id}')
+
+        checkpoint.phase = 'achievements'
+        db.session.commit()
+
+    if checkpoint.phase == 'achievements':
+        achievement_rows, credit_rows = _award_achievements(state)
+        if achievement_rows:
+            db.session.execute(insert(StagedUserAchievement), achievement_rows)
+            db.session.execute(insert(StagedGreenCredit), credit_rows)
+        _swap_in_staged()
+        checkpoint.phase = 'done'
+        db.session.commit()
+        total_rows += len(achievement_rows) + len(credit_rows)
+
+        clear_dashboard_summaries()
+        page_cache.invalidate('credits')
+
+    elapsed = time.perf_counter() - started
+    click.echo(f'Recompute finished: {total_rides} rides, {total_rows} rows in {elapsed:.2f}s '
+               f'({total_rows / elapsed if elapsed else 0:.0f} rows/sec)')
+
+@bp.cli.command('reconcile-balances')
+def reconcile_balances():
+    """Rebuild every user's credit balance from the credit ledger."""
+    rebuild_balances()
+    db.session.commit()
+    clear_dashboard_summaries()
+    page_cache.invalidate('credits')
+    click.echo('Credit balances rebuilt from the ledger.')
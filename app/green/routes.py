@@ -4,53 +4,64 @@ from app import db
 from app.green import bp
 from app.models.green_credits import GreenCredit, Achievement, UserAchievement, CreditRedemption
 from app.models.user import User
+from app.models.notification import Notification
 from app.models.ride import Ride, RideRequest
 from sqlalchemy import desc
+from sqlalchemy.orm import joinedload
 from datetime import datetime
+from uuid import uuid4
 from app.utils.distance import calculate_distance  # Import the utility function
+from app.utils.credits import redeem
+from app.utils.green_stats import get_dashboard_summary, get_leaderboard_users, paginate_history
+from app.utils.page_cache import cached_page
+from app.utils.read_state import mark_notifications_read
 
 @bp.route('/dashboard')
 @login_required
 def dashboard():
-    # Get user's green credits
-    credits = GreenCredit.query.filter_by(user_id=current_user.id).order_by(desc(GreenCredit.created_at)).all()
+    # Cursors for the older pages of credit and redemption history
+    credits_before = request.args.get('credits_before', type=int)
+    redemptions_before = request.args.get('redemptions_before', type=int)
     
-    # Get user's redemptions
-    redemptions = CreditRedemption.query.filter_by(user_id=current_user.id).order_by(desc(CreditRedemption.created_at)).all()
+    # Get a page of user's green credits
+    credits, next_credits_cursor = paginate_history(
+        GreenCredit, current_user.id, before_id=credits_before)
     
-    # Get user's achievements
-    user_achievements = UserAchievement.query.filter_by(user_id=current_user.id).order_by(desc(UserAchievement.earned_at)).all()
+    # Get a page of user's redemptions
+    redemptions, next_redemptions_cursor = paginate_history(
+        CreditRedemption, current_user.id, before_id=redemptions_before)
     
-    # Calculate total credits
-    total_credits = current_user.get_total_credits()
-    
-    # Calculate carbon saved
-    carbon_saved = current_user.get_carbon_saved()
+    # Get user's most recent achievements
+    user_achievements = UserAchievement.query.filter_by(user_id=current_user.id).options(
+        joinedload(UserAchievement.achievement)
+    ).order_by(desc(UserAchievement.earned_at)).limit(6).all()
     
-    # Get leaderboard position
-    leaderboard_position = current_user.get_leaderboard_position()
+    # Credits, carbon saved and leaderboard position (cached until the ledger changes)
+    summary = get_dashboard_summary(current_user)
     
     return render_template('green/dashboard.html', 
-                           total_credits=total_credits,
-                           carbon_saved=carbon_saved,
-                           leaderboard_position=leaderboard_position,
+                           total_credits=summary['total_credits'],
+                           carbon_saved=summary['carbon_saved'],
+                           leaderboard_position=summary['leaderboard_position'],
                            credits=credits,
                            redemptions=redemptions,
-                           user_achievements=user_achievements)
+                           user_achievements=user_achievements,
+                           credits_before=credits_before,
+                           redemptions_before=redemptions_before,
+                           next_credits_cursor=next_credits_cursor,
+                           next_redemptions_cursor=next_redemptions_cursor)
 
 @bp.route('/leaderboard')
+@cached_page(tags=('credits', 'users', 'rides'))
 def leaderboard():
-    # Get all users sorted by total credits
-    users = User.query.all()
-    users = sorted(users, key=lambda u: u.get_total_credits(), reverse=True)
-    
     # Get current user's position if logged in
     user_position = None
     if current_user.is_authenticated:
         user_position = current_user.get_leaderboard_position()
     
+    # Users sorted by credits are loaded by the template inside a cached fragment
     return render_template('green/leaderboard.html', 
-                           users=users,
+                           leaderboard_users=get_leaderboard_users,
                            user_position=user_position)
 
 @bp.route('/achievements')
@@ -70,6 +81,10 @@ def achievements():
     user_achievements = UserAchievement.query.filter_by(user_id=current_user.id).all()
     earned_achievement_ids = [ua.achievement_id for ua in user_achievements]
     
+    # Achievement notifications point here
+    if mark_notifications_read(current_user.id, 'achievement'):
+        db.session.commit()
+    
     return render_template('green/achievements.html',
                            all_achievements=all_achievements,
                            achievement_groups=achievement_groups,
@@ -78,9 +93,6 @@ def achievements():
 @bp.route('/redeem', methods=['GET', 'POST'])
 @login_required
 def redeem_credits():
-    # Get user's total credits
-    total_credits = current_user.get_total_credits()
-    
     if request.method == 'POST':
         reward_type = request.form.get('reward_type')
         amount = int(request.form.get('amount'))
@@ -105,19 +117,21 @@ def redeem_credits():
             flash('Invalid credit amount.', 'danger')
             return redirect(url_for('green.redeem_credits'))
         
-        # Check if user has enough credits
-        if total_credits < amount:
-            flash('You do not have enough credits for this reward.', 'danger')
+        # Debit the credits atomically; a retried submission reuses its key
+        try:
+            redemption, created = redeem(
+                current_user.id, amount, reward_type, details,
+                idempotency_key=request.form.get('idempotency_key') or None
+            )
+        except Exception as e:
+            db.session.rollback()
+            flash('Error redeeming credits. Please try again.', 'danger')
             return redirect(url_for('green.redeem_credits'))
         
-        # Create redemption record
-        redemption = CreditRedemption(
-            user_id=current_user.id,
-            amount=amount,
-            reward_type=reward_type,
-            reward_details=details
-        )
-        db.session.add(redemption)
+        if redemption is None:
+            db.session.rollback()
+            flash('You do not have enough credits for this reward.', 'danger')
+            return redirect(url_for('green.redeem_credits'))
         
         # Process reward
         reward_message = ''
@@ -128,16 +142,14 @@ def redeem_credits():
         elif reward_type == 'priority':
             reward_message = 'You now have priority matching for the next 14 days!'
         
-        try:
-            db.session.commit()
-            flash(f'Credits redeemed successfully! {reward_message}', 'success')
-        except Exception as e:
-            db.session.rollback()
-            flash('Error redeeming credits. Please try again.', 'danger')
-        
+        flash(f'Credits redeemed successfully! {reward_message}', 'success')
         return redirect(url_for('green.dashboard'))
     
-    return render_template('green/redeem.html', total_credits=total_credits)
+    # Get user's total credits
+    total_credits = current_user.get_total_credits()
+    
+    return render_template('green/redeem.html', total_credits=total_credits,
+                           idempotency_key=uuid4().hex)
 
 def award_ride_credits(ride_request):
     """Award green credits for completed ride"""
@@ -221,6 +233,7 @@ def check_achievements(user):
             # Add notification
             notification = Notification(
                 user_id=user.id,
+                type='achievement',
                 message=f"You've earned the '{achievement.name}' achievement!",
                 icon=achievement.icon,
                 link=url_for('green.achievements')
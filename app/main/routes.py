@@ -1,41 +1,42 @@
-from flask import render_template, flash, redirect, url_for, request
+from flask import render_template, flash, redirect, url_for, request, current_app
 from flask_login import current_user, login_required
 from app.main import bp
-from app.models.ride import Ride
 from app.models.user import User
-from datetime import datetime
-from werkzeug.utils import secure_filename
 import os
 from app import db
+from app.utils.page_cache import cached_page
+from app.utils.site_stats import get_site_stats
 
 @bp.route('/')
+@cached_page(tags=('rides', 'users', 'credits'))
 def index():
-    # Get some statistics for the landing page
-    total_users = User.query.count()
-    total_rides = Ride.query.count()
+    from app.rides.sweeper import ride_sweeper
     
-    # Count only active rides that haven't expired yet
-    current_time = datetime.utcnow()
-    active_rides = Ride.query.filter(
-        Ride.status == 'active',
-        Ride.departure_time > current_time
-    ).count()
+    # Statistics for the landing page come from the maintained counters; the
+    # background sweep expires past rides and recounts them, never this request
+    ride_sweeper.ensure_started(current_app._get_current_object())
+    stats = get_site_stats()
     
-    # Get top users for the leaderboard
-    users = User.query.all()
-    users = sorted(users, key=lambda u: u.get_total_credits(), reverse=True)[:5]  # Top 5 users
+    # Top users are loaded by the template inside a cached fragment
+    from app.utils.green_stats import get_top_users
     
     return render_template('main/index.html', 
                           title='Welcome',
-                          total_users=total_users,
-                          total_rides=total_rides,
-                          active_rides=active_rides,
-                          users=users)  # Pass users to the template
+                          total_users=stats.total_users,
+                          total_rides=stats.total_rides,
+                          active_rides=stats.active_rides,
+                          top_users=get_top_users)
 
 @bp.route('/profile')
 @login_required
 def profile():
-    return render_template('main/profile.html', title='Profile')
+    from app.utils.ratings import get_average_rating, get_recent_rating
+    
+    # Average of the ratings this user has received, from their rating summary
+    average_rating = get_average_rating(current_user.id)
+    recent_rating = get_recent_rating(current_user.id)
+    return render_template('main/profile.html', title='Profile', average_rating=average_rating,
+                           recent_rating=recent_rating)
 
 @bp.route('/update_profile', methods=['POST'])
 @login_required
@@ -76,26 +77,34 @@ def update_profile_picture():
         return redirect(url_for('main.profile'))
     
     if file:
-        filename = secure_filename(file.filename)
-        # Create a unique filename
-        unique_filename = f"{current_user.id}_{int(datetime.utcnow().timestamp())}_{filename}"
-        
-        # Ensure upload folder exists
+        # Stream the upload to disk; resizing happens on the avatar workers
         from flask import current_app
-        upload_folder = current_app.config['UPLOAD_FOLDER']
+        from uuid import uuid4
+        from app.utils.avatars import avatar_pipeline, incoming_folder
+        
+        upload_folder = incoming_folder(current_app)
         os.makedirs(upload_folder, exist_ok=True)
         
-        file_path = os.path.join(upload_folder, unique_filename)
+        file_path = os.path.join(upload_folder, f"{current_user.id}_{uuid4().hex}")
         file.save(file_path)
+        avatar_pipeline.submit(current_app._get_current_object(), current_user.id, file_path)
         
-        # Update user profile image
-        current_user.profile_image = unique_filename
-        db.session.commit()
-        
-        flash('Profile picture updated successfully!', 'success')
+        flash('Profile picture uploaded! It will appear once it has been processed.', 'success')
     
     return redirect(url_for('main.profile'))
 
+@bp.route('/avatars/<path:filename>')
+def avatar(filename):
+    """Serve processed avatars; names are content hashes, so they never change"""
+    from flask import current_app, send_from_directory
+    from app.utils.avatars import avatar_folder
+    
+    response = send_from_directory(avatar_folder(current_app), filename,
+                                   max_age=current_app.config['AVATAR_CACHE_MAX_AGE'])
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
 @bp.route('/change_password', methods=['POST'])
 @login_required
 def change_password():
@@ -114,13 +123,28 @@ def change_password():
         return redirect
 
 @bp.route('/about')
+@cached_page(timeout=3600)
 def about():
     return render_template('main/about.html', title='About Us')
 
 @bp.route('/contact')
+@cached_page(timeout=3600)
 def contact():
     return render_template('main/contact.html', title='Contact Us')
 
 @bp.route('/privacy')
+@cached_page(timeout=3600)
 def privacy():
     return render_template('main/privacy.html', title='Privacy Policy')
+
+@bp.route('/metrics')
+def metrics():
+    from flask import abort
+    from app.email import email_workers
+    from app.utils.request_metrics import request_metrics
+    
+    if not request_metrics.enabled:
+        abort(404)
+    if not request_metrics.is_authorized(request):
+        abort(403)
+    return request_metrics.render() + email_workers.render_metrics(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
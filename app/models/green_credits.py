@@ -47,9 +47,56 @@ class CreditRedemption(db.Model):
     reward_type = db.Column(db.String(32), nullable=False)
     reward_details = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    idempotency_key = db.Column(db.String(64))  # Set by the redeem form so retried submissions are not applied twice
     
     # Relationships
     user = db.relationship('User', backref='credit_redemptions')
     
+    __table_args__ = (
+        db.Index('ix_credit_redemption_user_key', 'user_id', 'idempotency_key', unique=True),
+    )
+    
+    def __repr__(self):
+        return f'<CreditRedemption {self.id}>'
+
+class CreditBalance(db.Model):
+    """Available credits per user, kept in step with the credit ledger"""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    balance = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<CreditBalance {self.user_id}: {self.balance}>'
+
+class RecomputeCheckpoint(db.Model):
+    """Progress of the `flask green recompute` command so it can resume"""
+    name = db.Column(db.String(64), primary_key=True)
+    phase = db.Column(db.String(32), nullable=False, default='rides')  # rides, achievements, done
+    last_ride_id = db.Column(db.Integer, nullable=False, default=0)
+    state = db.Column(db.Text)  # JSON per-user totals accumulated so far
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<RecomputeCheckpoint {self.name}: {self.phase} {self.last_ride_id}>'
+
+class StagedGreenCredit(db.Model):
+    """Credits built by `flask green recompute` before they replace the derived ledger rows"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False)
+    amount = db.Column(db.Integer, nullable=False)
+    reason = db.Column(db.String(256))
+    ride_id = db.Column(db.Integer)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<StagedGreenCredit {self.id}>'
+
+class StagedUserAchievement(db.Model):
+    """Achievements built by `flask green recompute` before they replace the earned ones"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False)
+    achievement_id = db.Column(db.Integer, nullable=False)
+    earned_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
     def __repr__(self):
-        return f'<CreditRedemption {self.id}>'
\ No newline at end of file
+        return f'<StagedUserAchievement {self.id}>'
@@ -13,5 +13,28 @@ class Message(db.Model):
     sender = db.relationship('User', foreign_keys=[sender_id], backref='sent_messages')
     ride_request = db.relationship('RideRequest', back_populates='messages', overlaps="request")
     
+    # Chat history is paged by id within a ride request
+    __table_args__ = (
+        db.Index('ix_message_ride_request_id_id', 'ride_request_id', 'id'),
+    )
+    
+    def __repr__(self):
+        return f'<Message {self.id}>'
+
+class ChatReadState(db.Model):
+    """Last message each participant has read in a ride request's chat"""
+    ride_request_id = db.Column(db.Integer, db.ForeignKey('ride_request.id'), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    last_read_message_id = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<ChatReadState {self.ride_request_id}:{self.user_id} @{self.last_read_message_id}>'
+
+class UnreadCounter(db.Model):
+    """Unread chat messages per user, maintained on message insert and read"""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    unread_count = db.Column(db.Integer, nullable=False, default=0)
+    
     def __repr__(self):
-        return f'<Message {self.id}>'
\ No newline at end of file
+        return f'<UnreadCounter {self.user_id}: {self.unread_count}>'
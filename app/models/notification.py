@@ -0,0 +1,25 @@
+from datetime import datetime
+from app import db
+
+class Notification(db.Model):
+    """Per-recipient inbox entry, stored ready to display"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    type = db.Column(db.String(32), nullable=False, default='message')  # message, achievement, ride
+    message = db.Column(db.String(256), nullable=False)
+    icon = db.Column(db.String(64))
+    link = db.Column(db.String(256))
+    sender_name = db.Column(db.String(64))
+    ride_request_id = db.Column(db.Integer, db.ForeignKey('ride_request.id'), nullable=True)
+    message_id = db.Column(db.Integer, db.ForeignKey('message.id'), nullable=True)  # For message entries
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    is_read = db.Column(db.Boolean, default=False)  # Set once the user has seen what it points to
+    
+    # Inbox reads are a range scan on the recipient's newest unread entries
+    __table_args__ = (
+        db.Index('ix_notification_user_id_created_at', 'user_id', 'created_at'),
+        db.Index('ix_notification_user_id_is_read_created_at', 'user_id', 'is_read', 'created_at'),
+    )
+    
+    def __repr__(self):
+        return f'<Notification {self.id}>'
@@ -50,6 +50,7 @@ class RideRequest(db.Model):
     pickup_longitude = db.Column(db.Float)
     seats_requested = db.Column(db.Integer, default=1)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    route_polyline = db.Column(db.Text)  # rider's tracked path, see app/utils/route_history.py
     
     # Update the relationship to use back_populates
     messages = db.relationship('Message', back_populates='ride_request', overlaps="request")
@@ -68,3 +69,27 @@ class Rating(db.Model):
     
     def __repr__(self):
         return f'<Rating {self.id}>'
+
+class RatingSummary(db.Model):
+    """
+    Ratings received per user, kept in step with the rating table.
+    The recency-weighted sums are decayed to updated_at, so their ratio
+    is the recency-weighted average at any time.
+    """
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    rating_sum = db.Column(db.Integer, nullable=False, default=0)
+    rating_count = db.Column(db.Integer, nullable=False, default=0)
+    weighted_sum = db.Column(db.Float, nullable=False, default=0)
+    weighted_count = db.Column(db.Float, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    @property
+    def average(self):
+        return self.rating_sum / self.rating_count if self.rating_count else None
+    
+    @property
+    def recent_average(self):
+        return self.weighted_sum / self.weighted_count if self.weighted_count else None
+    
+    def __repr__(self):
+        return f'<RatingSummary {self.user_id}: {self.rating_sum}/{self.rating_count}>'
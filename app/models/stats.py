@@ -0,0 +1,16 @@
+from datetime import datetime
+from app import db
+
+class SiteStats(db.Model):
+    """
+    Site-wide counters for the landing page, kept in a single row that is
+    updated as users and rides are added and rides change status.
+    """
+    id = db.Column(db.Integer, primary_key=True)  # Always 1
+    total_users = db.Column(db.Integer, nullable=False, default=0)
+    total_rides = db.Column(db.Integer, nullable=False, default=0)
+    active_rides = db.Column(db.Integer, nullable=False, default=0)
+    reconciled_at = db.Column(db.DateTime)  # Last recount from the user and ride tables
+    
+    def __repr__(self):
+        return f'<SiteStats users={self.total_users} rides={self.total_rides} active={self.active_rides}>'
@@ -1,11 +1,13 @@
 from datetime import datetime
 from app import db, login_manager
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
 
 @login_manager.user_loader
 def load_user(id):
-    return User.query.get(int(id))
+    from app.utils.user_cache import load_cached_user
+    
+    # Served from a snapshot cache; see app/utils/user_cache.py
+    return load_cached_user(int(id))
 
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -25,30 +27,42 @@ class User(UserMixin, db.Model):
                                 foreign_keys='RideRequest.traveler_id')
     
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        from app.utils.passwords import hash_password
+        self.password_hash = hash_password(password)
     
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        from app.utils.passwords import verify_password
+        return verify_password(self.password_hash, password)
+    
+    def password_needs_rehash(self):
+        """True if the stored hash predates the configured method or cost"""
+        from app.utils.passwords import needs_rehash
+        return needs_rehash(self.password_hash)
     
     def __repr__(self):
         return f'<User {self.username}>'
     
+    def avatar_url(self, size=256, fmt='jpg'):
+        """URL of the profile picture at a size from AVATAR_SIZES, or None if there is none"""
+        from flask import url_for
+        from app.utils.avatars import avatar_filename
+        
+        if not self.profile_image or self.profile_image == 'default.jpg':
+            return None
+        if self.profile_image.startswith('avatars/'):
+            name = self.profile_image.split('/', 1)[1]
+            return url_for('main.avatar', filename=avatar_filename(name, size, fmt))
+        # Uploaded before avatars were processed; served as stored
+        return url_for('static', filename='uploads/' + self.profile_image)
+    
     # Add these methods to the User class
     
     def get_total_credits(self):
         """Get total green credits for user"""
-        from app.models.green_credits import GreenCredit, CreditRedemption
+        from app.utils.credits import get_balance
         
-        # Sum all earned credits
-        earned = GreenCredit.query.filter_by(user_id=self.id).with_entities(
-            db.func.sum(GreenCredit.amount)).scalar() or 0
-        
-        # Sum all redeemed credits
-        redeemed = CreditRedemption.query.filter_by(user_id=self.id).with_entities(
-            db.func.sum(CreditRedemption.amount)).scalar() or 0
-        
-        # Return available credits
-        return earned - redeemed
+        # Available credits are kept on the user's balance row
+        return get_balance(self.id)
     
     def get_carbon_saved(self):
         """Get total carbon saved in kg CO2"""
@@ -84,13 +98,8 @@ class User(UserMixin, db.Model):
     
     def get_leaderboard_position(self):
         """Get the user's position on the leaderboard"""
-        # Get all users sorted by credits
-        users = User.query.all()
-        sorted_users = sorted(users, key=lambda u: u.get_total_credits(), reverse=True)
-        
-        # Find the position of the current user
-        for i, user in enumerate(sorted_users):
-            if user.id == self.id:
-                return i + 1  # +1 because positions start at 1, not 0
+        from app.utils.green_stats import get_credits_and_position
         
-        return len(sorted_users)  # Fallback if user not found
+        # Position is computed in SQL from grouped credit and redemption sums
+        _, position = get_credits_and_position(self.id)
+        return position
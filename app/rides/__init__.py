@@ -2,4 +2,4 @@ from flask import Blueprint
 
 bp = Blueprint('rides', __name__)
 
-from app.rides import routes
+from app.rides import routes, commands
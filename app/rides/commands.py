@@ -0,0 +1,9 @@
+import click
+from app.rides import bp
+from app.rides.sweeper import sweep
+
+@bp.cli.command('sweep')
+def sweep_rides():
+    """Complete expired rides and recount the landing page counters if due."""
+    expired = sweep()
+    click.echo(f'{expired} expired rides completed.')
@@ -6,7 +6,11 @@ from app import db
 from app.rides import bp
 from app.rides.forms import OfferRideForm, RequestRideForm, RatingForm, FindRideForm
 from app.models.ride import Ride, RideRequest, Rating
+from app.models.notification import Notification
 from app.utils.distance import calculate_distance
+from app.utils.read_state import get_unread_counts, mark_notifications_read
+from app.utils.routing import get_route as find_route, RoutingError
+from app.utils.geocoding import get_geocoder, GeocodingError
 import math
 
 def cleanup_expired_rides():
@@ -174,6 +178,10 @@ def my_rides():
     # Check and update expired rides before displaying
     fix_ride_status()
     
+    # Ride request notifications point here
+    if mark_notifications_read(current_user.id, 'ride'):
+        db.session.commit()
+    
     # Get current time for template
     now = datetime.utcnow()
     
@@ -182,7 +190,11 @@ def my_rides():
         return render_template('rides/my_rides_rider.html', title='My Rides', rides=offered_rides, now=now)
     else:
         requested_rides = RideRequest.query.filter_by(traveler_id=current_user.id).order_by(RideRequest.created_at.desc()).all()
-        return render_template('rides/my_rides_traveler.html', title='My Rides', requests=requested_rides, now=now)
+        
+        # Unread chat counts for every request, embedded at render time
+        unread_counts = get_unread_counts(current_user.id)
+        return render_template('rides/my_rides_traveler.html', title='My Rides', requests=requested_rides, now=now,
+                               unread_counts=unread_counts)
 
 @bp.route('/api/rides')
 def get_rides():
@@ -203,6 +215,50 @@ def get_rides():
         'price': ride.price
     } for ride in rides])
 
+@bp.route('/api/route')
+@login_required
+def get_route():
+    """Driving route and ETA between two points, in the shape OSRM returns"""
+    coords = [request.args.get(name, type=float)
+              for name in ('from_lat', 'from_lng', 'to_lat', 'to_lng')]
+    if any(value is None for value in coords):
+        return jsonify({'code': 'InvalidQuery', 'message': 'from_lat, from_lng, to_lat and to_lng are required'}), 400
+    
+    try:
+        route = find_route(*coords)
+    except RoutingError as e:
+        return jsonify({'code': 'NoRoute', 'message': str(e)}), 502
+    
+    return jsonify({'code': 'Ok', 'routes': [route]})
+
+@bp.route('/api/geocode/search')
+@login_required
+def geocode_search():
+    """Forward geocoding through the cached proxy, in Nominatim's JSON shape"""
+    query = request.args.get('q', '').strip()
+    limit = min(request.args.get('limit', 5, type=int), 10)
+    if not query:
+        return jsonify([])
+    
+    try:
+        return jsonify(get_geocoder().search(query, limit))
+    except GeocodingError as e:
+        return jsonify({'error': str(e)}), 502
+
+@bp.route('/api/geocode/reverse')
+@login_required
+def reverse_geocode():
+    """Reverse geocoding through the cached proxy, in Nominatim's JSON shape"""
+    lat = request.args.get('lat', type=float)
+    lon = request.args.get('lon', type=float)
+    if lat is None or lon is None:
+        return jsonify({'error': 'lat and lon are required'}), 400
+    
+    try:
+        return jsonify(get_geocoder().reverse(lat, lon))
+    except GeocodingError as e:
+        return jsonify({'error': str(e)}), 502
+
 # Add this import at the top of the file
 from app.utils.ride_matching import get_ride_matches
 
@@ -308,22 +364,39 @@ def handle_request(request_id, action):
         
         ride_request.status = 'accepted'
         ride.available_seats -= ride_request.seats_requested
+        db.session.add(Notification(
+            user_id=ride_request.traveler_id,
+            type='ride',
+            message=f'{current_user.username} accepted your ride request',
+            icon='fa-check-circle',
+            link=url_for('rides.my_rides'),
+            sender_name=current_user.username,
+            ride_request_id=ride_request.id
+        ))
         flash('Ride request accepted!', 'success')
     
     elif action == 'reject':
         ride_request.status = 'rejected'
+        db.session.add(Notification(
+            user_id=ride_request.traveler_id,
+            type='ride',
+            message=f'{current_user.username} declined your ride request',
+            icon='fa-times-circle',
+            link=url_for('rides.my_rides'),
+            sender_name=current_user.username,
+            ride_request_id=ride_request.id
+        ))
         flash('Ride request rejected.', 'info')
     
     db.session.commit()
     return redirect(url_for('rides.my_rides'))
 
-# Import the green credits functions at the top of the file
-from app.green.routes import award_ride_credits
-
 # Update the complete_ride route
 @bp.route('/complete/<int:ride_id>')
 @login_required
 def complete_ride(ride_id):
+    from app.green.routes import award_ride_credits
+    
     ride = Ride.query.get_or_404(ride_id)
     
     if ride.rider_id != current_user.id:
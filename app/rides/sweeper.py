@@ -0,0 +1,55 @@
+from threading import Lock
+from app import socketio, db
+from app.utils.site_stats import get_site_stats, needs_reconcile, reconcile_site_stats
+
+def sweep():
+    """
+    Complete rides past their departure time, then recount the landing
+    page counters if they are due. Returns the number of rides completed.
+    """
+    from app.rides.routes import cleanup_expired_rides
+    expired = cleanup_expired_rides()
+    if needs_reconcile(get_site_stats()):
+        reconcile_site_stats()
+    return expired
+
+class RideSweeper:
+    """
+    Background task that runs sweep() every interval seconds, so expiring
+    rides and recounting the counters stay out of requests. It is started
+    by the first request that needs it; a failing sweep is logged and the
+    next one runs as usual.
+    """
+
+    def __init__(self, interval=60):
+        self.interval = interval
+        self._lock = Lock()
+        self._app = None
+        self._task = None
+
+    def ensure_started(self, app):
+        """Start the sweeper for this app if it is not running yet"""
+        with self._lock:
+            if self._task is None:
+                self._app = app
+                self.interval = app.config.get('RIDE_SWEEP_INTERVAL', self.interval)
+                self._task = socketio.start_background_task(self._run)
+
+    def _run(self):
+        try:
+            while True:
+                try:
+                    with self._app.app_context():
+                        sweep()
+                except Exception:
+                    self._app.logger.exception('Ride sweep failed')
+                finally:
+                    with self._app.app_context():
+                        db.session.remove()
+                socketio.sleep(self.interval)
+        finally:
+            # Let the next request start a new sweeper if this one died
+            with self._lock:
+                self._task = None
+
+ride_sweeper = RideSweeper()
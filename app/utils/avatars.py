@@ -0,0 +1,95 @@
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from PIL import Image, ImageOps
+from app import db
+
+# Square sizes generated for every avatar, in pixels
+AVATAR_SIZES = (256, 48)
+
+# Output formats and Pillow save options; WebP first, JPEG as the fallback
+AVATAR_FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpg': ('JPEG', {'quality': 85, 'optimize': True, 'progressive': True}),
+}
+
+def avatar_folder(app):
+    return os.path.join(app.config['UPLOAD_FOLDER'], 'avatars')
+
+def incoming_folder(app):
+    return os.path.join(app.config['UPLOAD_FOLDER'], 'incoming')
+
+def avatar_filename(name, size, fmt):
+    """File name of one rendition; name is the content hash stored on the user"""
+    return f'{name}_{size}.{fmt}'
+
+def _file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:20]
+
+def render_avatars(source_path, output_folder):
+    """
+    Decode an uploaded image and write every size and format. Orientation
+    from EXIF is applied, then all metadata is dropped by re-encoding the
+    pixels only. Returns the content hash that names the renditions.
+    """
+    name = _file_hash(source_path)
+    os.makedirs(output_folder, exist_ok=True)
+
+    with Image.open(source_path) as image:
+        image = ImageOps.exif_transpose(image).convert('RGB')
+        for size in AVATAR_SIZES:
+            thumbnail = ImageOps.fit(image, (size, size), Image.LANCZOS)
+            for fmt, (pil_format, options) in AVATAR_FORMATS.items():
+                path = os.path.join(output_folder, avatar_filename(name, size, fmt))
+                if os.path.exists(path):
+                    continue  # Same content was processed before
+                # Write under a temporary name so readers never see half a file
+                thumbnail.save(path + '.tmp', pil_format, **options)
+                os.replace(path + '.tmp', path)
+    return name
+
+class AvatarPipeline:
+    """
+    Processes uploaded profile pictures on a small worker pool so the
+    upload request only has to stream the file to disk. When an image is
+    ready the user's profile_image is switched to it; files that cannot
+    be decoded are discarded and the old picture is kept.
+    """
+
+    def __init__(self, workers=2):
+        self.workers = workers
+        self._executor = None
+        self._lock = Lock()
+
+    def submit(self, app, user_id, source_path):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=app.config.get('AVATAR_WORKERS', self.workers),
+                    thread_name_prefix='avatar')
+        return self._executor.submit(self._process, app, user_id, source_path)
+
+    def _process(self, app, user_id, source_path):
+        from app.models.user import User
+
+        with app.app_context():
+            try:
+                name = render_avatars(source_path, avatar_folder(app))
+            except (OSError, ValueError, Image.DecompressionBombError) as e:
+                app.logger.warning('Discarding profile picture from user %s: %s', user_id, e)
+                return None
+            finally:
+                os.remove(source_path)
+
+            user = db.session.get(User, user_id)
+            if user is not None:
+                user.profile_image = f'avatars/{name}'
+                db.session.commit()
+            return name
+
+avatar_pipeline = AvatarPipeline()
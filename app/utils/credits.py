@@ -0,0 +1,129 @@
+from sqlalchemy import event, exists, func, insert, literal, select, update
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.models.green_credits import GreenCredit, CreditRedemption, CreditBalance
+from app.models.user import User
+
+def _ledger_balance(user_id):
+    """SQL expression for a user's available credits computed from the ledger"""
+    earned = select(func.coalesce(func.sum(GreenCredit.amount), 0)).where(
+        GreenCredit.user_id == user_id
+    ).scalar_subquery()
+    redeemed = select(func.coalesce(func.sum(CreditRedemption.amount), 0)).where(
+        CreditRedemption.user_id == user_id
+    ).scalar_subquery()
+    return earned - redeemed
+
+def _ensure_balance_row(connection, user_id):
+    """Create the balance row from the ledger if the user does not have one yet"""
+    connection.execute(
+        insert(CreditBalance.__table__).from_select(
+            ['user_id', 'balance'],
+            select(literal(user_id), _ledger_balance(user_id)).where(
+                ~exists().where(CreditBalance.user_id == user_id)
+            )
+        )
+    )
+
+def get_balance(user_id):
+    """Get a user's available credits from their balance row"""
+    balance = db.session.query(CreditBalance.balance).filter_by(user_id=user_id).scalar()
+    if balance is None:
+        # No balance row yet, fall back to the ledger without writing
+        balance = db.session.query(_ledger_balance(user_id)).scalar()
+    return balance or 0
+
+def redeem(user_id, amount, reward_type, details, idempotency_key=None):
+    """
+    Redeem credits with an atomic conditional debit on the user's balance row
+    and commit. Returns (redemption, created). A retried submission with the
+    same idempotency key returns the original redemption with created=False.
+    Returns (None, False) if the user does not have enough credits; nothing
+    is debited and the caller decides what to do with its transaction.
+    """
+    if idempotency_key:
+        existing = CreditRedemption.query.filter_by(
+            user_id=user_id, idempotency_key=idempotency_key).first()
+        if existing:
+            return existing, False
+
+    redemption = CreditRedemption(
+        user_id=user_id,
+        amount=amount,
+        reward_type=reward_type,
+        reward_details=details,
+        idempotency_key=idempotency_key
+    )
+    try:
+        # A savepoint, so a failed redemption leaves the caller's work alone
+        with db.session.begin_nested():
+            connection = db.session.connection()
+            _ensure_balance_row(connection, user_id)
+
+            # Debit only if enough credits are left; concurrent debits for the same
+            # user serialize on this row, other users' rows are unaffected
+            result = connection.execute(
+                update(CreditBalance.__table__).where(
+                    CreditBalance.user_id == user_id,
+                    CreditBalance.balance >= amount
+                ).values(balance=CreditBalance.balance - amount)
+            )
+            if result.rowcount != 1:
+                return None, False
+            db.session.add(redemption)
+    except IntegrityError:
+        # The same key was committed by a concurrent submission; our debit is rolled back
+        existing = CreditRedemption.query.filter_by(
+            user_id=user_id, idempotency_key=idempotency_key).first()
+        return existing, False
+
+    db.session.commit()
+    return redemption, True
+
+def rebuild_balances(user_ids=None):
+    """
+    Recompute balance rows from the ledger, for the given users or everyone.
+    Use after bulk statements that skip the ledger hooks. The caller commits.
+    """
+    earned = select(func.coalesce(func.sum(GreenCredit.amount), 0)).where(
+        GreenCredit.user_id == User.id).scalar_subquery()
+    redeemed = select(func.coalesce(func.sum(CreditRedemption.amount), 0)).where(
+        CreditRedemption.user_id == User.id).scalar_subquery()
+
+    stale = CreditBalance.query
+    users = select(User.id, earned - redeemed)
+    if user_ids is not None:
+        stale = stale.filter(CreditBalance.user_id.in_(user_ids))
+        users = users.where(User.id.in_(user_ids))
+    stale.delete(synchronize_session=False)
+    db.session.execute(insert(CreditBalance.__table__).from_select(['user_id', 'balance'], users))
+
+@event.listens_for(GreenCredit, 'before_insert')
+def _before_credit_earned(mapper, connection, target):
+    # Backfill from the ledger before the row is written so it is counted once
+    _ensure_balance_row(connection, target.user_id)
+
+@event.listens_for(GreenCredit, 'after_insert')
+def _credit_earned(mapper, connection, target):
+    connection.execute(
+        update(CreditBalance.__table__).where(
+            CreditBalance.user_id == target.user_id
+        ).values(balance=CreditBalance.balance + target.amount)
+    )
+
+@event.listens_for(GreenCredit, 'after_delete')
+def _credit_removed(mapper, connection, target):
+    connection.execute(
+        update(CreditBalance.__table__).where(
+            CreditBalance.user_id == target.user_id
+        ).values(balance=CreditBalance.balance - target.amount)
+    )
+
+@event.listens_for(CreditRedemption, 'after_delete')
+def _redemption_removed(mapper, connection, target):
+    # A cancelled redemption gives its credits back
+    connection.execute(
+        update(CreditBalance.__table__).where(
+            CreditBalance.user_id == target.user_id
+        ).values(balance=CreditBalance.balance + target.amount)
+    )
@@ -0,0 +1,86 @@
+import math
+import sqlite3
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from app import db
+
+DATABASE_PROFILES = ('default', 'production')
+
+def _profile(config, profile):
+    profile = profile or config.get('DATABASE_PROFILE', 'default')
+    if profile not in DATABASE_PROFILES:
+        raise ValueError(f'Unknown DATABASE_PROFILE {profile!r}')
+    return profile
+
+def _is_memory_sqlite(url):
+    return url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:')
+
+def sqlite_pragmas(config, profile=None):
+    """PRAGMAs run on every new SQLite connection for the given (or configured) profile"""
+    if _profile(config, profile) == 'default':
+        return {}
+    return {
+        'journal_mode': 'WAL',  # Readers see the last commit instead of waiting for the writer
+        'synchronous': 'NORMAL',  # Safe with WAL; fsync on checkpoint rather than every commit
+        'busy_timeout': config.get('SQLITE_BUSY_TIMEOUT', 5000),
+        'mmap_size': config.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024),
+        'cache_size': -config.get('SQLITE_CACHE_SIZE', 64 * 1024),  # Negative means KiB
+    }
+
+def engine_options(config, profile=None):
+    """SQLALCHEMY_ENGINE_OPTIONS for the given (or configured) profile"""
+    url = make_url(config['SQLALCHEMY_DATABASE_URI'])
+    # In-memory SQLite keeps Flask-SQLAlchemy's single shared connection
+    if _profile(config, profile) == 'default' or _is_memory_sqlite(url):
+        return {}
+
+    options = {
+        'pool_size': config.get('DATABASE_POOL_SIZE', 10),
+        'max_overflow': config.get('DATABASE_MAX_OVERFLOW', 20),
+        'pool_timeout': config.get('DATABASE_POOL_TIMEOUT', 30),
+    }
+    if url.get_backend_name() != 'sqlite':
+        # Server databases drop idle connections; SQLite files never do
+        options.update(pool_pre_ping=True, pool_recycle=1800)
+    return options
+
+def enable_pragmas(engine, pragmas):
+    """Run the given PRAGMAs on each connection the engine opens"""
+    if not pragmas or engine.dialect.name != 'sqlite':
+        return
+
+    @event.listens_for(engine, 'connect')
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name}={value}')
+        cursor.close()
+
+# SQL math functions used by queries, with Python fallbacks for SQLite
+MATH_FUNCTIONS = {
+    'power': (2, math.pow),
+    'sqrt': (1, math.sqrt),
+    'sin': (1, math.sin),
+    'cos': (1, math.cos),
+    'asin': (1, math.asin),
+    'radians': (1, math.radians),
+}
+
+def enable_math_functions(engine):
+    """Provide the MATH_FUNCTIONS on SQLite builds compiled without them"""
+    if engine.dialect.name != 'sqlite':
+        return
+
+    @event.listens_for(engine, 'connect')
+    def _add_math_functions(dbapi_connection, connection_record):
+        try:
+            dbapi_connection.execute('SELECT power(2, 2), sqrt(4), sin(0), cos(0), asin(0), radians(0)')
+        except sqlite3.OperationalError:
+            for name, (arity, function) in MATH_FUNCTIONS.items():
+                dbapi_connection.create_function(name, arity, function, deterministic=True)
+
+def configure_database(app):
+    """Apply the profile's pragmas to the app's engine; call after db.init_app"""
+    with app.app_context():
+        enable_pragmas(db.engine, sqlite_pragmas(app.config))
+        enable_math_functions(db.engine)
@@ -0,0 +1,113 @@
+import json
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from threading import Lock
+
+class DiskCache:
+    """
+    Small persistent key/value store in its own SQLite file.
+
+    Values are stored as JSON. Entries older than max_age seconds are
+    treated as missing. Kept apart from the application database so cache
+    traffic never contends with it and the file can be deleted at any time.
+    """
+
+    def __init__(self, path, table='cache', max_age=None):
+        self.path = path
+        self.table = table
+        self.max_age = max_age
+        self._lock = Lock()
+        self._connection = None
+
+    def _connect(self):
+        if self._connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.execute(
+                f'CREATE TABLE IF NOT EXISTS {self.table} '
+                '(key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL)'
+            )
+        return self._connection
+
+    def get(self, key):
+        entry = self.get_entry(key)
+        return entry[0] if entry else None
+
+    def get_entry(self, key):
+        """(value, created_at) for a fresh entry, or None"""
+        with self._lock:
+            row = self._connect().execute(
+                f'SELECT value, created_at FROM {self.table} WHERE key = ?', (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        value, created_at = row
+        if self.max_age is not None and time.time() - created_at > self.max_age:
+            return None
+        return json.loads(value), created_at
+
+    def set(self, key, value):
+        with self._lock:
+            connection = self._connect()
+            connection.execute(
+                f'INSERT OR REPLACE INTO {self.table} (key, value, created_at) VALUES (?, ?, ?)',
+                (key, json.dumps(value), time.time())
+            )
+            connection.commit()
+
+    def purge(self):
+        """Delete entries older than max_age"""
+        if self.max_age is None:
+            return
+        with self._lock:
+            connection = self._connect()
+            connection.execute(f'DELETE FROM {self.table} WHERE created_at < ?',
+                               (time.time() - self.max_age,))
+            connection.commit()
+
+class TieredCache:
+    """
+    In-memory LRU of at most size entries in front of an optional DiskCache.
+    Disk hits are promoted into the LRU. Entries older than max_age seconds
+    (the disk cache's max_age unless given) are treated as missing in both
+    tiers; promoted entries keep the age they had on disk.
+    """
+
+    def __init__(self, size=1024, disk=None, max_age=None):
+        self.size = size
+        self.disk = disk
+        self.max_age = max_age if max_age is not None or disk is None else disk.max_age
+        self._entries = OrderedDict()  # key -> (value, created_at)
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                value, created_at = self._entries[key]
+                if self.max_age is None or time.time() - created_at <= self.max_age:
+                    self._entries.move_to_end(key)
+                    return value
+                del self._entries[key]
+
+        entry = self.disk.get_entry(key) if self.disk else None
+        if entry is None:
+            return None
+        value, created_at = entry
+        self._remember(key, value, created_at)
+        return value
+
+    def set(self, key, value):
+        self._remember(key, value, time.time())
+        if self.disk:
+            self.disk.set(key, value)
+
+    def _remember(self, key, value, created_at):
+        with self._lock:
+            self._entries[key] = (value, created_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
@@ -0,0 +1,202 @@
+import os
+import sqlite3
+import time
+from threading import Event, Lock
+import requests
+from flask import current_app
+from app.utils.disk_cache import DiskCache, TieredCache
+
+class GeocodingError(Exception):
+    pass
+
+class NominatimBackend:
+    """Forward and reverse lookups against a Nominatim server"""
+
+    def __init__(self, base_url, user_agent, timeout=5):
+        self.base_url = base_url.rstrip('/')
+        self.user_agent = user_agent
+        self.timeout = timeout
+
+    def _get(self, path, params):
+        try:
+            response = requests.get(f'{self.base_url}/{path}', params=dict(params, format='json'),
+                                    headers={'User-Agent': self.user_agent}, timeout=self.timeout)
+            response.raise_for_status()
+            return response.json()
+        except (requests.RequestException, ValueError) as e:
+            raise GeocodingError(str(e)) from e
+
+    def search(self, query, limit):
+        return self._get('search', {'q': query, 'limit': limit})
+
+    def reverse(self, lat, lon):
+        return self._get('reverse', {'lat': lat, 'lon': lon})
+
+class StubBackend:
+    """
+    Offline backend for tests: reverse lookups name the coordinates and
+    searches return the query itself at 0, 0. Counts calls so tests can
+    check what reached the upstream.
+    """
+
+    def __init__(self):
+        self.calls = 0
+
+    def search(self, query, limit):
+        self.calls += 1
+        return [{'display_name': query, 'lat': '0', 'lon': '0'}][:limit]
+
+    def reverse(self, lat, lon):
+        self.calls += 1
+        return {'display_name': f'{lat:.5f}, {lon:.5f}', 'lat': str(lat), 'lon': str(lon)}
+
+class Pacer:
+    """
+    Hands out upstream call slots at least min_interval seconds apart.
+    With a path, the last slot is kept in a SQLite file so every worker on
+    the host shares one pace; without one the pace is per process. A
+    caller whose slot would be more than max_wait seconds away is refused
+    with a GeocodingError instead of queueing.
+    """
+
+    def __init__(self, min_interval, max_wait=None, path=None):
+        if min_interval < 0:
+            raise ValueError(f'min_interval must be >= 0, got {min_interval!r}')
+        self.min_interval = min_interval
+        self.max_wait = max_wait
+        self.path = path
+        self._lock = Lock()
+        self._connection = None
+        self._last_slot = 0
+
+    def _connect(self):
+        if self._connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # Autocommit mode so BEGIN IMMEDIATE below is the only transaction
+            self._connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS pace (name TEXT PRIMARY KEY, last_slot REAL NOT NULL)')
+        return self._connection
+
+    def _next_slot(self, last_slot, now):
+        slot = max(now, last_slot + self.min_interval)
+        if self.max_wait is not None and slot - now > self.max_wait:
+            raise GeocodingError(f'Geocoding is busy, next slot in {slot - now:.1f}s')
+        return slot
+
+    def reserve(self):
+        """Reserve the next slot; returns the seconds to sleep before calling upstream"""
+        if not self.min_interval:
+            return 0
+        now = time.time()
+        with self._lock:
+            if self.path is None:
+                slot = self._last_slot = self._next_slot(self._last_slot, now)
+                return slot - now
+
+            connection = self._connect()
+            # Takes the file's write lock, so workers reserve one at a time
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                row = connection.execute("SELECT last_slot FROM pace WHERE name = 'upstream'").fetchone()
+                slot = self._next_slot(row[0] if row else 0, time.time())
+                connection.execute("INSERT OR REPLACE INTO pace (name, last_slot) VALUES ('upstream', ?)",
+                                   (slot,))
+                connection.execute('COMMIT')
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+        return slot - now
+
+class GeocodingService:
+    """
+    Cached, deduplicated and paced geocoding.
+
+    Reverse lookups are keyed on coordinates rounded to `precision`
+    decimals (4 is about 11 m) and searches on the lower-cased,
+    whitespace-collapsed query. Concurrent misses for the same key share
+    one upstream call, and upstream calls are spaced by the pacer
+    (Nominatim allows one request a second).
+    """
+
+    def __init__(self, backend, cache=None, precision=4, pacer=None):
+        self.backend = backend
+        self.cache = cache or TieredCache()
+        self.precision = precision
+        self.pacer = pacer or Pacer(1.0)
+        self._in_flight = {}
+        self._in_flight_lock = Lock()
+
+    def search(self, query, limit=5):
+        normalized = ' '.join(query.lower().split())
+        return self._lookup(f'search:{limit}:{normalized}',
+                            lambda: self.backend.search(normalized, limit))
+
+    def reverse(self, lat, lon):
+        lat, lon = round(lat, self.precision), round(lon, self.precision)
+        return self._lookup(f'reverse:{lat:.{self.precision}f},{lon:.{self.precision}f}',
+                            lambda: self.backend.reverse(lat, lon))
+
+    def _lookup(self, key, fetch):
+        result = self.cache.get(key)
+        if result is not None:
+            return result
+
+        with self._in_flight_lock:
+            waiter = self._in_flight.get(key)
+            if waiter is None:
+                waiter = self._in_flight[key] = {'done': Event(), 'result': None, 'error': None}
+                owner = True
+            else:
+                owner = False
+
+        if not owner:
+            # Someone else is already asking upstream for this key
+            waiter['done'].wait()
+            if waiter['error'] is not None:
+                raise waiter['error']
+            return waiter['result']
+
+        try:
+            waiter['result'] = self._paced(fetch)
+            self.cache.set(key, waiter['result'])
+            return waiter['result']
+        except Exception as e:
+            waiter['error'] = e
+            raise
+        finally:
+            with self._in_flight_lock:
+                del self._in_flight[key]
+            waiter['done'].set()
+
+    def _paced(self, fetch):
+        # Other lookups reserve their own slots while this one sleeps and fetches
+        wait = self.pacer.reserve()
+        if wait > 0:
+            time.sleep(wait)
+        return fetch()
+
+def create_geocoding_service(app):
+    """Build the geocoding service described by the app config"""
+    if app.config['GEOCODING_BACKEND'] == 'stub':
+        backend, min_interval = StubBackend(), 0
+    else:
+        backend = NominatimBackend(app.config['GEOCODING_NOMINATIM_URL'],
+                                   app.config['GEOCODING_USER_AGENT'])
+        min_interval = app.config['GEOCODING_MIN_INTERVAL']
+
+    cache_path = app.config.get('GEOCODING_CACHE_PATH') or os.path.join(app.instance_path, 'geocode_cache.db')
+    disk = DiskCache(cache_path, table='geocode', max_age=app.config['GEOCODING_CACHE_MAX_AGE'])
+    # Workers on the host pace against the same cache file
+    pacer = Pacer(min_interval, app.config.get('GEOCODING_MAX_WAIT'), cache_path)
+    return GeocodingService(backend, TieredCache(app.config['GEOCODING_CACHE_SIZE'], disk),
+                            app.config['GEOCODING_CACHE_PRECISION'], pacer)
+
+def get_geocoder():
+    """Get the geocoding service for the current app"""
+    service = current_app.extensions.get('geocoding')
+    if service is None:
+        service = current_app.extensions['geocoding'] = create_geocoding_service(current_app)
+    return service
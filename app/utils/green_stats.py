@@ -0,0 +1,228 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+from flask import current_app
+from sqlalchemy import Float, Numeric, and_, case, cast, event, func, or_, select
+from sqlalchemy.orm import Session, object_session
+from app import db
+from app.models.green_credits import GreenCredit, CreditRedemption, CreditBalance, UserAchievement
+from app.models.ride import Ride, RideRequest
+from app.models.user import User
+
+# Number of history rows shown per page on the dashboard
+HISTORY_PAGE_SIZE = 10
+
+# Maximum number of per-user summaries kept in memory
+SUMMARY_CACHE_SIZE = 1024
+
+_summary_cache = OrderedDict()
+_summary_lock = Lock()
+
+def user_balances_subquery():
+    """
+    Per-user available credits as a subquery: the balance row where there
+    is one, like get_balance, otherwise earned - redeemed from the ledger
+    """
+    earned = db.session.query(
+        GreenCredit.user_id.label('user_id'),
+        func.sum(GreenCredit.amount).label('total')
+    ).group_by(GreenCredit.user_id).subquery()
+
+    redeemed = db.session.query(
+        CreditRedemption.user_id.label('user_id'),
+        func.sum(CreditRedemption.amount).label('total')
+    ).group_by(CreditRedemption.user_id).subquery()
+
+    return db.session.query(
+        User.id.label('user_id'),
+        func.coalesce(
+            CreditBalance.balance,
+            func.coalesce(earned.c.total, 0) - func.coalesce(redeemed.c.total, 0)
+        ).label('balance')
+    ).outerjoin(CreditBalance, CreditBalance.user_id == User.id).outerjoin(
+        earned, earned.c.user_id == User.id
+    ).outerjoin(
+        redeemed, redeemed.c.user_id == User.id
+    ).subquery()
+
+def get_credits_and_position(user_id):
+    """
+    Get a user's available credits and leaderboard position in one query.
+    Ties are ordered by user id, matching the sorted leaderboard.
+    """
+    balances = user_balances_subquery()
+    mine = db.session.query(balances.c.balance).filter(
+        balances.c.user_id == user_id
+    ).scalar_subquery()
+
+    ahead = db.session.query(func.count()).select_from(balances).filter(
+        or_(
+            balances.c.balance > mine,
+            and_(balances.c.balance == mine, balances.c.user_id < user_id)
+        )
+    ).scalar_subquery()
+
+    row = db.session.query(mine.label('balance'), ahead.label('ahead')).one()
+    return (row.balance or 0), row.ahead + 1
+
+def _round(value, digits=2):
+    # round(double, int) needs a numeric argument on some databases
+    return func.round(cast(value, Numeric), digits, type_=Float)
+
+def _ride_distance():
+    """SQL expression for a ride's haversine distance in km, rounded like calculate_distance"""
+    lat1, lat2 = func.radians(Ride.start_latitude), func.radians(Ride.end_latitude)
+    dlat = lat2 - lat1
+    dlon = func.radians(Ride.end_longitude) - func.radians(Ride.start_longitude)
+    a = func.power(func.sin(dlat / 2), 2) + func.cos(lat1) * func.cos(lat2) * func.power(func.sin(dlon / 2), 2)
+    return _round(6371 * 2 * func.asin(func.sqrt(a)))
+
+def carbon_saved_subquery(user_id=None):
+    """
+    Per-user carbon saved in kg CO2 as a subquery, for one user or everyone.
+    Riders save distance * 0.12 per completed passenger on their completed
+    rides, travelers distance * 0.12 per completed ride they took.
+    """
+    passengers = select(
+        RideRequest.ride_id, func.count(RideRequest.id).label('count')
+    ).where(RideRequest.status == 'completed').group_by(RideRequest.ride_id).subquery()
+    as_rider = select(
+        Ride.rider_id.label('user_id'),
+        func.sum(_round(_ride_distance() * 0.12 * passengers.c.count)).label('total')
+    ).join(passengers, passengers.c.ride_id == Ride.id).where(
+        Ride.status == 'completed'
+    ).group_by(Ride.rider_id)
+    as_traveler = select(
+        RideRequest.traveler_id.label('user_id'),
+        func.sum(_ride_distance() * 0.12).label('total')
+    ).join(Ride, Ride.id == RideRequest.ride_id).where(
+        RideRequest.status == 'completed'
+    ).group_by(RideRequest.traveler_id)
+    if user_id is not None:
+        as_rider = as_rider.where(Ride.rider_id == user_id)
+        as_traveler = as_traveler.where(RideRequest.traveler_id == user_id)
+    as_rider, as_traveler = as_rider.subquery(), as_traveler.subquery()
+
+    query = select(
+        User.id.label('user_id'),
+        _round(case(
+            (User.role == 'rider', func.coalesce(as_rider.c.total, 0)),
+            else_=func.coalesce(as_traveler.c.total, 0)
+        )).label('carbon_saved')
+    ).outerjoin(as_rider, as_rider.c.user_id == User.id).outerjoin(
+        as_traveler, as_traveler.c.user_id == User.id
+    )
+    if user_id is not None:
+        query = query.where(User.id == user_id)
+    return query.subquery()
+
+def get_top_users(limit=None):
+    """
+    Users ordered by available credits, ties by user id, as rows of
+    id, username and balance from one query
+    """
+    balances = user_balances_subquery()
+    query = db.session.query(User.id, User.username, balances.c.balance).join(
+        balances, balances.c.user_id == User.id
+    ).order_by(balances.c.balance.desc(), User.id)
+    if limit:
+        query = query.limit(limit)
+    return query.all()
+
+def get_leaderboard_users(limit=None):
+    """
+    Leaderboard rows of id, username, balance, carbon_saved and achievements
+    (the number earned), ordered like get_top_users, from one query
+    """
+    balances = user_balances_subquery()
+    carbon = carbon_saved_subquery()
+    achievements = select(func.count(UserAchievement.id)).where(
+        UserAchievement.user_id == User.id
+    ).scalar_subquery()
+
+    query = db.session.query(
+        User.id, User.username, balances.c.balance,
+        carbon.c.carbon_saved, achievements.label('achievements')
+    ).join(balances, balances.c.user_id == User.id).join(
+        carbon, carbon.c.user_id == User.id
+    ).order_by(balances.c.balance.desc(), User.id)
+    if limit:
+        query = query.limit(limit)
+    return query.all()
+
+def get_carbon_saved(user):
+    """Get total carbon saved in kg CO2 using a single query"""
+    total_saved = db.session.query(carbon_saved_subquery(user.id).c.carbon_saved).scalar()
+    return float(total_saved or 0)
+
+def get_dashboard_summary(user):
+    """
+    Get the green dashboard summary for a user. Summaries are cached per
+    user for GREEN_SUMMARY_TTL seconds, and dropped earlier once a commit
+    changes the user's own ledger. The leaderboard position also moves
+    when other users earn credits, so it can be up to the TTL old.
+    """
+    now = time.monotonic()
+    with _summary_lock:
+        entry = _summary_cache.get(user.id)
+        if entry is not None and entry[0] > now:
+            _summary_cache.move_to_end(user.id)
+            return entry[1]
+
+    total_credits, leaderboard_position = get_credits_and_position(user.id)
+    summary = {
+        'total_credits': total_credits,
+        'carbon_saved': get_carbon_saved(user),
+        'leaderboard_position': leaderboard_position
+    }
+
+    expires_at = now + current_app.config.get('GREEN_SUMMARY_TTL', 60)
+    with _summary_lock:
+        _summary_cache[user.id] = (expires_at, summary)
+        _summary_cache.move_to_end(user.id)
+        while len(_summary_cache) > SUMMARY_CACHE_SIZE:
+            _summary_cache.popitem(last=False)
+
+    return summary
+
+def invalidate_dashboard_summary(user_id):
+    """Drop the cached dashboard summary for a user"""
+    with _summary_lock:
+        _summary_cache.pop(user_id, None)
+
+def clear_dashboard_summaries():
+    """Drop every cached dashboard summary, e.g. after a bulk ledger rebuild"""
+    with _summary_lock:
+        _summary_cache.clear()
+
+def paginate_history(model, user_id, before_id=None, per_page=HISTORY_PAGE_SIZE):
+    """
+    Keyset-paginate a user's ledger rows newest first.
+    Returns the page of rows and the cursor for the next (older) page.
+    """
+    query = model.query.filter(model.user_id == user_id)
+    if before_id:
+        query = query.filter(model.id < before_id)
+
+    rows = query.order_by(model.id.desc()).limit(per_page + 1).all()
+    next_cursor = rows[per_page - 1].id if len(rows) > per_page else None
+    return rows[:per_page], next_cursor
+
+@event.listens_for(GreenCredit, 'after_insert')
+@event.listens_for(GreenCredit, 'after_delete')
+@event.listens_for(CreditRedemption, 'after_insert')
+@event.listens_for(CreditRedemption, 'after_delete')
+def _ledger_changed(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault('dashboard_summary_users', set()).add(target.user_id)
+
+# Drop summaries once the ledger change is visible to other requests
+@event.listens_for(Session, 'after_commit')
+def _ledger_committed(session):
+    for user_id in session.info.pop('dashboard_summary_users', ()):
+        invalidate_dashboard_summary(user_id)
+
+@event.listens_for(Session, 'after_rollback')
+def _ledger_rolled_back(session):
+    session.info.pop('dashboard_summary_users', None)
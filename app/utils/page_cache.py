@@ -0,0 +1,254 @@
+import json
+import os
+import time
+from collections import OrderedDict
+from functools import wraps
+from threading import Lock
+from uuid import uuid4
+from flask import make_response, request, session
+from flask_login import current_user
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, object_session
+from app.models.green_credits import CreditRedemption, GreenCredit, UserAchievement
+from app.models.ride import Ride, RideRequest
+from app.models.user import User
+from app.utils.disk_cache import DiskCache
+
+class MemoryBackend:
+    """LRU of at most size entries in this process"""
+
+    def __init__(self, size=1024):
+        self.size = size
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout=None):
+        expires_at = time.monotonic() + timeout if timeout else None
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+class SQLiteBackend:
+    """
+    Entries in a SQLite file shared by every worker on the host. Rows
+    older than max_age are purged every purge_every writes.
+    """
+
+    def __init__(self, path, max_age=24 * 3600, purge_every=1000):
+        self.disk = DiskCache(path, table='page_cache', max_age=max_age)
+        self.purge_every = purge_every
+        self._writes = 0
+
+    def get(self, key):
+        entry = self.disk.get(key)
+        if entry is None:
+            return None
+        if entry['expires_at'] is not None and entry['expires_at'] < time.time():
+            return None
+        return entry['value']
+
+    def set(self, key, value, timeout=None):
+        self.disk.set(key, {'expires_at': time.time() + timeout if timeout else None, 'value': value})
+        self._writes += 1
+        if self._writes % self.purge_every == 0:
+            self.disk.purge()
+
+class RedisBackend:
+    """Entries in Redis, shared by every worker that points at the same server"""
+
+    def __init__(self, url, prefix='rideshare:page:'):
+        import redis  # Only needed when PAGE_CACHE_BACKEND is 'redis'
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return json.loads(value) if value is not None else None
+
+    def set(self, key, value, timeout=None):
+        self.client.set(self.prefix + key, json.dumps(value), ex=timeout or None)
+
+def create_backend(app):
+    """Build the cache backend named by PAGE_CACHE_BACKEND, or None when caching is off"""
+    name = app.config.get('PAGE_CACHE_BACKEND', 'memory')
+    if name == 'none':
+        return None
+    if name == 'memory':
+        return MemoryBackend(app.config.get('PAGE_CACHE_SIZE', 1024))
+    if name == 'sqlite':
+        path = app.config.get('PAGE_CACHE_PATH') or os.path.join(app.instance_path, 'page_cache.db')
+        return SQLiteBackend(path)
+    if name == 'redis':
+        return RedisBackend(app.config['PAGE_CACHE_URL'])
+    raise ValueError(f'Unknown PAGE_CACHE_BACKEND {name!r}')
+
+class PageCache:
+    """
+    Caches rendered pages and template fragments under tags. Each tag has
+    a version stored in the backend and every cache key includes the
+    versions of its tags, so invalidating a tag (giving it a new version)
+    makes all entries under it unreachable in every process sharing the
+    backend. Unreachable entries age out of the backend on their own.
+    """
+
+    def __init__(self, timeout=300):
+        self.timeout = timeout
+        self.backend = None
+
+    def init_app(self, app):
+        self.backend = create_backend(app)
+        self.timeout = app.config.get('PAGE_CACHE_TIMEOUT', self.timeout)
+        app.jinja_env.add_extension(CacheExtension)
+
+    def _key(self, parts, tags):
+        versions = []
+        for tag in sorted(tags):
+            version = self.backend.get(f'tag:{tag}')
+            if version is None:
+                # Unknown or evicted tag: start a new version so old entries never match
+                version = uuid4().hex
+                self.backend.set(f'tag:{tag}', version)
+            versions.append(f'{tag}={version}')
+        return '|'.join([str(part) for part in parts] + versions)
+
+    def invalidate(self, *tags):
+        """Make everything cached under any of the given tags stale"""
+        if self.backend is None:
+            return
+        for tag in tags:
+            self.backend.set(f'tag:{tag}', uuid4().hex)
+
+    def fragment(self, parts, tags, timeout, render):
+        """Get a cached fragment, rendering and storing it on a miss"""
+        if self.backend is None:
+            return render()
+        key = self._key(['fragment'] + list(parts), tags)
+        value = self.backend.get(key)
+        if value is None:
+            value = render()
+            self.backend.set(key, str(value), timeout or self.timeout)
+        return value
+
+    def cached_page(self, timeout=None, tags=()):
+        """
+        Decorator caching a view's whole response for anonymous GETs. Logged-in
+        users, visitors with pending flash messages and responses that touch
+        the session or are not 200 OK always go to the view.
+        """
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if (self.backend is None or request.method not in ('GET', 'HEAD')
+                        or '_flashes' in session or current_user.is_authenticated):
+                    return view(*args, **kwargs)
+
+                key = self._key(['page', request.full_path], tags)
+                cached = self.backend.get(key)
+                if cached is not None:
+                    response = make_response(cached['body'], 200)
+                    response.content_type = cached['content_type']
+                    response.headers['X-Cache'] = 'HIT'
+                    return response
+
+                response = make_response(view(*args, **kwargs))
+                if response.status_code == 200 and not session.modified and not response.direct_passthrough:
+                    self.backend.set(key, {
+                        'body': response.get_data(as_text=True),
+                        'content_type': response.content_type,
+                    }, timeout or self.timeout)
+                    response.headers['X-Cache'] = 'MISS'
+                return response
+            return wrapper
+        return decorator
+
+page_cache = PageCache()
+cached_page = page_cache.cached_page
+
+class CacheExtension(Extension):
+    """
+    {% cache 'name', vary..., tags=['credits'], timeout=300 %}...{% endcache %}
+    caches the enclosed template output. Positional arguments form the key.
+    """
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        parts, kwargs = [], []
+        while parser.stream.current.type != 'block_end':
+            if parts or kwargs:
+                parser.stream.expect('comma')
+            if parser.stream.current.type == 'name' and parser.stream.look().type == 'assign':
+                name = next(parser.stream).value
+                next(parser.stream)
+                kwargs.append(nodes.Keyword(name, parser.parse_expression(), lineno=lineno))
+            else:
+                parts.append(parser.parse_expression())
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        call = self.call_method('_render', [nodes.List(parts)], kwargs)
+        return nodes.CallBlock(call, [], [], body).set_lineno(lineno)
+
+    def _render(self, parts, tags=(), timeout=None, caller=None):
+        return Markup(page_cache.fragment(parts, tags, timeout, caller))
+
+# What each tag covers: ride counts and carbon saved, user counts and
+# names, and credit totals and achievements
+_MODEL_TAGS = {
+    Ride: 'rides',
+    RideRequest: 'rides',
+    User: 'users',
+    GreenCredit: 'credits',
+    CreditRedemption: 'credits',
+    UserAchievement: 'credits',
+}
+
+# Updates only matter to cached pages when they touch a displayed column;
+# logins rehashing a password, for one, leave the pages as they are
+_DISPLAYED_COLUMNS = {
+    User: ('username', 'role'),  # Names on the leaderboards; the role decides carbon saved
+}
+
+def _record_change(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault('page_cache_tags', set()).add(_MODEL_TAGS[mapper.class_])
+
+def _record_update(mapper, connection, target):
+    columns = _DISPLAYED_COLUMNS.get(mapper.class_)
+    if columns is not None:
+        state = inspect(target)
+        if not any(state.attrs[column].history.has_changes() for column in columns):
+            return
+    _record_change(mapper, connection, target)
+
+for _model in _MODEL_TAGS:
+    event.listen(_model, 'after_insert', _record_change)
+    event.listen(_model, 'after_update', _record_update)
+    event.listen(_model, 'after_delete', _record_change)
+
+# Invalidate only once the change is visible to other requests
+@event.listens_for(Session, 'after_commit')
+def _invalidate_changed(session):
+    tags = session.info.pop('page_cache_tags', None)
+    if tags:
+        page_cache.invalidate(*tags)
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_changed(session):
+    session.info.pop('page_cache_tags', None)
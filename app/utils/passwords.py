@@ -0,0 +1,78 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from flask import current_app
+from werkzeug.security import generate_password_hash, check_password_hash
+from app import bcrypt, socketio
+
+# Cost used when PASSWORD_HASH_COST is not set: bcrypt log2 rounds,
+# pbkdf2 iterations, scrypt N
+DEFAULT_COSTS = {'bcrypt': 12, 'pbkdf2': 600000, 'scrypt': 32768}
+
+_executor = None
+_executor_lock = Lock()
+
+def hash_settings(app=None):
+    """Get the configured (method, cost)"""
+    config = (app or current_app).config
+    method = config.get('PASSWORD_HASH_METHOD', 'scrypt')
+    if method not in DEFAULT_COSTS:
+        raise ValueError(f'Unknown PASSWORD_HASH_METHOD {method!r}')
+    return method, config.get('PASSWORD_HASH_COST') or DEFAULT_COSTS[method]
+
+def _hash(password, method, cost):
+    if method == 'bcrypt':
+        return bcrypt.generate_password_hash(password, cost).decode('utf-8')
+    if method == 'pbkdf2':
+        return generate_password_hash(password, method=f'pbkdf2:sha256:{cost}')
+    return generate_password_hash(password, method=f'scrypt:{cost}:8:1')
+
+def _verify(password_hash, password):
+    if password_hash.startswith('$2'):
+        return bcrypt.check_password_hash(password_hash, password)
+    return check_password_hash(password_hash, password)
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            workers = current_app.config.get('PASSWORD_HASH_WORKERS') or os.cpu_count() or 1
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash')
+        return _executor
+
+def _offload(fn, *args):
+    """
+    Run CPU-heavy hashing on an OS thread. Under eventlet or gevent the
+    hub's native thread pool is used so the event loop keeps serving
+    sockets; otherwise a shared pool of PASSWORD_HASH_WORKERS threads
+    bounds how many hashes run at once.
+    """
+    mode = socketio.async_mode
+    if mode == 'eventlet':
+        from eventlet import tpool
+        return tpool.execute(fn, *args)
+    if mode in ('gevent', 'gevent_uwsgi'):
+        import gevent
+        return gevent.get_hub().threadpool.apply(fn, args)
+    return _get_executor().submit(fn, *args).result()
+
+def hash_password(password, method=None, cost=None):
+    """Hash a password with the configured (or given) method and cost"""
+    if method is None:
+        method, cost = hash_settings()
+    return _offload(_hash, password, method, cost or DEFAULT_COSTS[method])
+
+def verify_password(password_hash, password):
+    """Check a password against a bcrypt, scrypt or pbkdf2 hash"""
+    if not password_hash:
+        return False
+    return _offload(_verify, password_hash, password)
+
+def needs_rehash(password_hash):
+    """True if a hash was made with a different method or cost than configured"""
+    method, cost = hash_settings()
+    if method == 'bcrypt':
+        return not password_hash.startswith('$2') or password_hash.split('$')[2] != f'{cost:02d}'
+    if method == 'pbkdf2':
+        return not password_hash.startswith(f'pbkdf2:sha256:{cost}$')
+    return not password_hash.startswith(f'scrypt:{cost}:8:1$')
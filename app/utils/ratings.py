@@ -0,0 +1,94 @@
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import case, event, exists, func, insert, literal, select, update
+from app import db
+from app.models.ride import Rating, RatingSummary
+
+def _age_days(connection, column, now):
+    """SQL expression for the days from `column` (or now, if null) to now, never negative"""
+    column = func.coalesce(column, now)
+    if connection.dialect.name == 'sqlite':
+        age = func.julianday(now) - func.julianday(column)
+    else:
+        age = func.extract('epoch', now - column) / 86400
+    return case((age > 0, age), else_=0)
+
+def _decay(connection, column, now):
+    """SQL expression for the weight left after `column` has aged to now, from RATING_HALF_LIFE_DAYS"""
+    half_life = current_app.config.get('RATING_HALF_LIFE_DAYS', 90)
+    return func.power(0.5, _age_days(connection, column, now) / half_life)
+
+def _ensure_summary_row(connection, user_id, now):
+    """Build the summary row from existing ratings if the user has none yet"""
+    weight = _decay(connection, Rating.created_at, now)
+    connection.execute(
+        insert(RatingSummary.__table__).from_select(
+            ['user_id', 'rating_sum', 'rating_count', 'weighted_sum', 'weighted_count', 'updated_at'],
+            select(
+                literal(user_id),
+                func.coalesce(func.sum(Rating.rating), 0),
+                func.count(Rating.id),
+                func.coalesce(func.sum(Rating.rating * weight), 0.0),
+                func.coalesce(func.sum(weight), 0.0),
+                literal(now, db.DateTime)
+            ).where(Rating.to_user_id == user_id).having(
+                # The aggregate always yields a row; keep it only if the user has none
+                ~exists().where(RatingSummary.user_id == user_id)
+            )
+        )
+    )
+
+def get_average_ratings(user_ids):
+    """
+    Get {user_id: average rating} for several users with one read of their
+    summary rows. Users without ratings are left out.
+    """
+    user_ids = set(user_ids)
+    if not user_ids:
+        return {}
+
+    averages = {}
+    for summary in RatingSummary.query.filter(RatingSummary.user_id.in_(user_ids)):
+        if summary.rating_count:
+            averages[summary.user_id] = summary.average
+        user_ids.discard(summary.user_id)
+
+    # Users rated before summaries existed get their row on their next rating
+    if user_ids:
+        averages.update(
+            (user_id, float(average)) for user_id, average in db.session.query(
+                Rating.to_user_id, func.avg(Rating.rating)
+            ).filter(Rating.to_user_id.in_(user_ids)).group_by(Rating.to_user_id)
+        )
+    return averages
+
+def get_average_rating(user_id):
+    """Get a user's average rating, or None if they have not been rated"""
+    return get_average_ratings([user_id]).get(user_id)
+
+def get_recent_rating(user_id):
+    """Get a user's recency-weighted average rating, or None without a summary row"""
+    summary = db.session.get(RatingSummary, user_id)
+    return summary.recent_average if summary else None
+
+@event.listens_for(Rating, 'before_insert')
+def _before_rating_added(mapper, connection, target):
+    # Backfill from existing ratings before the row is written so it is counted once
+    _ensure_summary_row(connection, target.to_user_id, datetime.utcnow())
+
+@event.listens_for(Rating, 'after_insert')
+def _rating_added(mapper, connection, target):
+    # Decay the weighted sums to now and add the new rating in one statement
+    now = datetime.utcnow()
+    decay = _decay(connection, RatingSummary.updated_at, now)
+    connection.execute(
+        update(RatingSummary.__table__).where(
+            RatingSummary.user_id == target.to_user_id
+        ).values(
+            rating_sum=RatingSummary.rating_sum + target.rating,
+            rating_count=RatingSummary.rating_count + 1,
+            weighted_sum=RatingSummary.weighted_sum * decay + target.rating,
+            weighted_count=RatingSummary.weighted_count * decay + 1,
+            updated_at=now
+        )
+    )
@@ -0,0 +1,305 @@
+from datetime import datetime
+from flask import current_app, url_for
+from sqlalchemy import and_, case, event, exists, func, insert, literal, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from app import db, socketio
+from app.models.message import Message, ChatReadState, UnreadCounter
+from app.models.notification import Notification
+from app.models.ride import Ride, RideRequest
+from app.models.user import User
+
+def get_last_read(ride_request_id, user_id):
+    """Get the id of the last message the user has read in a chat"""
+    last_read = db.session.query(ChatReadState.last_read_message_id).filter_by(
+        ride_request_id=ride_request_id, user_id=user_id).scalar()
+    return last_read or 0
+
+def mark_read(ride_request_id, user_id, message_id=None):
+    """
+    Move the user's read watermark forward to message_id (default: the
+    latest message in the chat). The watermark never moves backwards, and
+    the user's unread counter drops by the messages it passes over.
+    Returns True if the watermark moved. The caller commits.
+    """
+    if message_id is None:
+        message_id = db.session.query(func.max(Message.id)).filter(
+            Message.ride_request_id == ride_request_id).scalar()
+    if not message_id:
+        return False
+    
+    while True:
+        last_read = db.session.query(ChatReadState.last_read_message_id).filter_by(
+            ride_request_id=ride_request_id, user_id=user_id).scalar()
+        if last_read is not None and last_read >= message_id:
+            return False
+        
+        if last_read is None:
+            # First read in this chat
+            try:
+                with db.session.begin_nested():
+                    db.session.add(ChatReadState(
+                        ride_request_id=ride_request_id,
+                        user_id=user_id,
+                        last_read_message_id=message_id
+                    ))
+                break
+            except IntegrityError:
+                continue
+        
+        # Compare-and-set so concurrent readers do not both count the same messages
+        result = db.session.execute(
+            update(ChatReadState).where(
+                ChatReadState.ride_request_id == ride_request_id,
+                ChatReadState.user_id == user_id,
+                ChatReadState.last_read_message_id == last_read
+            ).values(last_read_message_id=message_id, updated_at=datetime.utcnow())
+        )
+        if result.rowcount:
+            break
+    
+    # Inbox entries for the messages now read are done with
+    mark_notifications_read(user_id, 'message', ride_request_id, up_to_message_id=message_id)
+    
+    newly_read = Message.query.filter(
+        Message.ride_request_id == ride_request_id,
+        Message.sender_id != user_id,
+        Message.id > (last_read or 0),
+        Message.id <= message_id
+    ).count()
+    if newly_read:
+        db.session.execute(
+            update(UnreadCounter).where(UnreadCounter.user_id == user_id).values(
+                unread_count=case(
+                    (UnreadCounter.unread_count > newly_read, UnreadCounter.unread_count - newly_read),
+                    else_=0
+                )
+            )
+        )
+    return True
+
+def mark_notifications_read(user_id, type, ride_request_id=None, up_to_message_id=None):
+    """
+    Mark the user's unread inbox entries of a type as read, optionally only
+    those for one chat or, for message entries, those for messages up to a
+    message id. Returns the number of entries marked. The caller commits.
+    """
+    query = Notification.query.filter(
+        Notification.user_id == user_id,
+        Notification.type == type,
+        Notification.is_read.is_(False)
+    )
+    if ride_request_id is not None:
+        query = query.filter(Notification.ride_request_id == ride_request_id)
+    if up_to_message_id is not None:
+        # Entries from before message ids were stored go once the chat is read
+        query = query.filter(or_(Notification.message_id <= up_to_message_id,
+                                 Notification.message_id.is_(None)))
+    return query.update({Notification.is_read: True}, synchronize_session=False)
+
+def unread_messages_query(user_id):
+    """
+    Messages sent to the user that are above the user's read watermark,
+    across all of the user's chats. Callers restrict by ride request.
+    """
+    return Message.query.outerjoin(ChatReadState, and_(
+        ChatReadState.ride_request_id == Message.ride_request_id,
+        ChatReadState.user_id == user_id
+    )).filter(
+        Message.sender_id != user_id,
+        Message.id > func.coalesce(ChatReadState.last_read_message_id, 0)
+    )
+
+def get_unread_count(ride_request_id, user_id):
+    """Count messages from the other participant above the user's watermark"""
+    return Message.query.filter(
+        Message.ride_request_id == ride_request_id,
+        Message.sender_id != user_id,
+        Message.id > get_last_read(ride_request_id, user_id)
+    ).count()
+
+def get_unread_counts(user_id, ride_request_ids=None):
+    """
+    Unread counts for all of the user's chats (as traveler or rider) in one
+    grouped query. Returns {ride_request_id: count} for chats with unread messages.
+    """
+    query = unread_messages_query(user_id).join(
+        RideRequest, RideRequest.id == Message.ride_request_id
+    ).join(Ride, Ride.id == RideRequest.ride_id).filter(
+        or_(RideRequest.traveler_id == user_id, Ride.rider_id == user_id)
+    )
+    if ride_request_ids is not None:
+        query = query.filter(Message.ride_request_id.in_(ride_request_ids))
+    
+    return dict(query.with_entities(
+        Message.ride_request_id, func.count(Message.id)
+    ).group_by(Message.ride_request_id).all())
+
+def _participant_unread_count(user_id):
+    """Unread messages across all of the user's chats, computed from the watermarks"""
+    return select(func.count(Message.id)).select_from(Message).join(
+        RideRequest, RideRequest.id == Message.ride_request_id
+    ).join(Ride, Ride.id == RideRequest.ride_id).outerjoin(ChatReadState, and_(
+        ChatReadState.ride_request_id == Message.ride_request_id,
+        ChatReadState.user_id == user_id
+    )).where(
+        or_(RideRequest.traveler_id == user_id, Ride.rider_id == user_id),
+        Message.sender_id != user_id,
+        Message.id > func.coalesce(ChatReadState.last_read_message_id, 0)
+    ).scalar_subquery()
+
+def _ensure_unread_counter(connection, user_id):
+    """Create the user's counter row from the read watermarks if it does not exist yet"""
+    connection.execute(
+        insert(UnreadCounter.__table__).from_select(
+            ['user_id', 'unread_count'],
+            select(literal(user_id), _participant_unread_count(user_id)).where(
+                ~exists().where(UnreadCounter.user_id == user_id)
+            )
+        )
+    )
+
+def get_unread_total(user_id):
+    """
+    Get the user's unread message count from their counter row. Users
+    without a row yet are counted from the read watermarks without writing;
+    the row is created when the next message is sent to them.
+    """
+    unread_count = db.session.query(UnreadCounter.unread_count).filter_by(user_id=user_id).scalar()
+    if unread_count is None:
+        unread_count = db.session.query(_participant_unread_count(user_id)).scalar()
+    return unread_count or 0
+
+def backfill_read_state():
+    """
+    Seed read watermarks from messages marked is_read before watermarks
+    existed: each reader's watermark in a chat is raised to the newest
+    message they had read there, and their unread counter is recounted.
+    Watermarks never move backwards, so running it again changes nothing.
+    Returns the number of watermarks created or raised. Commits.
+    """
+    reader_id = case(
+        (Message.sender_id == RideRequest.traveler_id, Ride.rider_id),
+        else_=RideRequest.traveler_id
+    )
+    read_up_to = db.session.query(
+        Message.ride_request_id, reader_id, func.max(Message.id)
+    ).join(RideRequest, RideRequest.id == Message.ride_request_id).join(
+        Ride, Ride.id == RideRequest.ride_id
+    ).filter(Message.is_read.is_(True)).group_by(Message.ride_request_id, reader_id).all()
+    
+    readers, changed = set(), 0
+    for ride_request_id, user_id, message_id in read_up_to:
+        state = db.session.get(ChatReadState, (ride_request_id, user_id))
+        if state is None:
+            db.session.add(ChatReadState(ride_request_id=ride_request_id, user_id=user_id,
+                                         last_read_message_id=message_id))
+        elif state.last_read_message_id < message_id:
+            state.last_read_message_id = message_id
+        else:
+            continue
+        readers.add(user_id)
+        changed += 1
+    db.session.flush()
+    
+    # Counters were built from the old watermarks
+    for user_id in readers:
+        db.session.execute(
+            update(UnreadCounter).where(UnreadCounter.user_id == user_id).values(
+                unread_count=_participant_unread_count(user_id)
+            )
+        )
+    db.session.commit()
+    return changed
+
+def backfill_notifications():
+    """
+    Bring the inbox up to date for data from before it tracked read state:
+    message entries without a read flag are marked read if their chat has
+    nothing unread for the user, other entries are left unread, and unread
+    messages get an entry unless one (or an entry without a message id)
+    already exists for them. Returns the number of entries created. Commits.
+    """
+    recipient_id = case(
+        (Message.sender_id == RideRequest.traveler_id, Ride.rider_id),
+        else_=RideRequest.traveler_id
+    )
+    
+    def unread_messages():
+        return db.session.query(Message.id).join(
+            RideRequest, RideRequest.id == Message.ride_request_id
+        ).join(Ride, Ride.id == RideRequest.ride_id).outerjoin(ChatReadState, and_(
+            ChatReadState.ride_request_id == Message.ride_request_id,
+            ChatReadState.user_id == recipient_id
+        )).filter(Message.id > func.coalesce(ChatReadState.last_read_message_id, 0))
+    
+    chat_unread = unread_messages().filter(
+        Message.ride_request_id == Notification.ride_request_id,
+        recipient_id == Notification.user_id
+    ).exists()
+    db.session.execute(
+        update(Notification).where(Notification.is_read.is_(None)).values(
+            is_read=and_(Notification.type == 'message', ~chat_unread)
+        ).execution_options(synchronize_session=False)
+    )
+    
+    covered = exists().where(
+        Notification.user_id == recipient_id,
+        Notification.ride_request_id == Message.ride_request_id,
+        Notification.type == 'message',
+        or_(Notification.message_id == Message.id, Notification.message_id.is_(None))
+    )
+    unread = unread_messages().join(User, User.id == Message.sender_id).filter(~covered).with_entities(
+        Message.id, Message.ride_request_id, Message.created_at, recipient_id, User.username
+    ).all()
+    
+    # Links are built outside of any request
+    with current_app.test_request_context():
+        for message_id, ride_request_id, created_at, user_id, sender_name in unread:
+            db.session.add(Notification(
+                user_id=user_id,
+                type='message',
+                message=f'New message from {sender_name}',
+                icon='fa-comment-alt',
+                link=url_for('chat.chat', request_id=ride_request_id),
+                sender_name=sender_name,
+                ride_request_id=ride_request_id,
+                message_id=message_id,
+                created_at=created_at
+            ))
+    db.session.commit()
+    return len(unread)
+
+def push_unread_count(user_id):
+    """Push the user's unread count to their notification room"""
+    socketio.emit('unread_count', {'unread_count': get_unread_total(user_id)},
+                  room=f'user_{user_id}_notifications')
+
+@event.listens_for(Message, 'before_insert')
+def _message_sending(mapper, connection, target):
+    # Senders that already know the recipient set it on the message
+    if getattr(target, 'recipient_id', None) is None:
+        # The recipient is whichever participant did not send the message
+        participants = connection.execute(
+            select(RideRequest.traveler_id, Ride.rider_id).join(
+                Ride, Ride.id == RideRequest.ride_id
+            ).where(RideRequest.id == target.ride_request_id)
+        ).first()
+        if participants is None:
+            return
+        
+        traveler_id, rider_id = participants
+        target.recipient_id = rider_id if target.sender_id == traveler_id else traveler_id
+    
+    # Build a missing counter row before the message is written so it is counted once
+    _ensure_unread_counter(connection, target.recipient_id)
+
+@event.listens_for(Message, 'after_insert')
+def _message_sent(mapper, connection, target):
+    recipient_id = getattr(target, 'recipient_id', None)
+    if recipient_id is None:
+        return
+    connection.execute(
+        update(UnreadCounter.__table__).where(
+            UnreadCounter.user_id == recipient_id
+        ).values(unread_count=UnreadCounter.unread_count + 1)
+    )
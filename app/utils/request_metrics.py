@@ -0,0 +1,201 @@
+import hmac
+import ipaddress
+import re
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextvars import ContextVar
+from functools import wraps
+from threading import Lock
+from flask import request
+from sqlalchemy import event
+from app import db
+
+# Upper bounds of the histogram buckets; +Inf is implied
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+_WHITESPACE = re.compile(r'\s+')
+_EXPANDED_IN = re.compile(r'\(\?(?:, \?)+\)')
+
+def statement_shape(statement):
+    """Collapse whitespace and expanded IN lists so equal queries compare equal"""
+    return _EXPANDED_IN.sub('(?, ...)', _WHITESPACE.sub(' ', statement).strip())
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def samples(self):
+        """(le, cumulative count) pairs ending with +Inf"""
+        total = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            total += count
+            yield bound, total
+
+class _Scope:
+    """SQL activity of one HTTP request or Socket.IO event"""
+    __slots__ = ('kind', 'endpoint', 'started', 'queries', 'sql_time', 'shapes')
+
+    def __init__(self, kind, endpoint=None):
+        self.kind = kind
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.sql_time = 0.0
+        self.shapes = Counter()
+
+_current_scope = ContextVar('request_metrics_scope', default=None)
+
+class RequestMetrics:
+    """
+    Counts queries and SQL time per endpoint and Socket.IO event using
+    SQLAlchemy cursor events. When a statement with the same shape runs
+    more than repeat_threshold times in one request or event, a warning
+    names the endpoint and the statement. Totals are kept per process
+    and rendered in the Prometheus text format.
+
+    There is one series per Flask endpoint (request.endpoint, not the
+    URL, so path parameters do not add series) and per Socket.IO event;
+    every request that matches no route, including all 404s, shares the
+    'unmatched' series.
+    """
+
+    def __init__(self, repeat_threshold=10):
+        self.repeat_threshold = repeat_threshold
+        self.enabled = False
+        self.token = None
+        self.allowed_networks = []
+        self._app = None
+        self._lock = Lock()
+        self._series = {}  # (kind, endpoint) -> {name: Histogram}
+        self._repeats = Counter()  # (kind, endpoint) -> scopes with a repeated statement
+
+    def init_app(self, app):
+        self._app = app
+        self.enabled = app.config.get('METRICS_ENABLED', False)
+        self.repeat_threshold = app.config.get('SQL_REPEAT_THRESHOLD', self.repeat_threshold)
+        self.token = app.config.get('METRICS_TOKEN')
+        self.allowed_networks = [ipaddress.ip_network(address.strip(), strict=False) for address
+                                 in (app.config.get('METRICS_ALLOWED_IPS') or '').split(',') if address.strip()]
+        if not self.enabled:
+            return
+
+        with app.app_context():
+            event.listen(db.engine, 'before_cursor_execute', self._before_cursor_execute)
+            event.listen(db.engine, 'after_cursor_execute', self._after_cursor_execute)
+
+        @app.before_request
+        def _start_request_scope():
+            _current_scope.set(_Scope('http'))
+
+        # Flask-SocketIO also tears down a request context after each event
+        @app.teardown_request
+        def _finish_request_scope(exc):
+            scope = _current_scope.get()
+            if scope is not None and scope.kind == 'http':
+                _current_scope.set(None)
+                scope.endpoint = request.endpoint or 'unmatched'
+                self._finish(scope)
+
+    def is_authorized(self, request):
+        """True if the request may read /metrics: a matching bearer token or an allowed address"""
+        if self.token:
+            scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+            if scheme.lower() == 'bearer' and hmac.compare_digest(token.encode(), self.token.encode()):
+                return True
+        try:
+            address = ipaddress.ip_address(request.remote_addr or '')
+        except ValueError:
+            return False
+        return any(address in network for network in self.allowed_networks)
+
+    def instrument_socketio(self, socketio):
+        """Wrap every registered Socket.IO handler; call after the handlers are imported"""
+        if not self.enabled:
+            return
+        for handlers in socketio.server.handlers.values():
+            for name, handler in handlers.items():
+                handlers[name] = self._wrap_event(name, handler)
+
+    def _wrap_event(self, name, handler):
+        @wraps(handler)
+        def instrumented(*args):
+            scope = _Scope('socketio', name)
+            token = _current_scope.set(scope)
+            try:
+                return handler(*args)
+            finally:
+                _current_scope.reset(token)
+                self._finish(scope)
+        return instrumented
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info['query_started'] = time.perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        now = time.perf_counter()
+        elapsed = now - conn.info.pop('query_started', now)
+        scope = _current_scope.get()
+        if scope is not None:
+            scope.queries += 1
+            scope.sql_time += elapsed
+            scope.shapes[statement_shape(statement)] += 1
+
+    def _finish(self, scope):
+        key = (scope.kind, scope.endpoint)
+        repeated = [(shape, count) for shape, count in scope.shapes.items()
+                    if count > self.repeat_threshold]
+        for shape, count in repeated:
+            self._app.logger.warning('%s %s ran the same statement %d times: %s',
+                                     scope.kind, scope.endpoint, count, shape[:300])
+
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {
+                    'duration_seconds': Histogram(SECONDS_BUCKETS),
+                    'sql_queries': Histogram(QUERY_COUNT_BUCKETS),
+                    'sql_seconds': Histogram(SECONDS_BUCKETS),
+                }
+            series['duration_seconds'].observe(time.perf_counter() - scope.started)
+            series['sql_queries'].observe(scope.queries)
+            series['sql_seconds'].observe(scope.sql_time)
+            if repeated:
+                self._repeats[key] += 1
+
+    def render(self):
+        """All series in the Prometheus text exposition format"""
+        descriptions = {
+            'duration_seconds': 'Time spent handling the request or event.',
+            'sql_queries': 'SQL statements executed per request or event.',
+            'sql_seconds': 'Time spent in SQL per request or event.',
+        }
+        lines = []
+        with self._lock:
+            for name, description in descriptions.items():
+                metric = f'rideshare_{name}'
+                lines += [f'# HELP {metric} {description}', f'# TYPE {metric} histogram']
+                for (kind, endpoint), series in sorted(self._series.items()):
+                    histogram = series[name]
+                    labels = f'kind="{kind}",endpoint="{endpoint}"'
+                    for bound, count in histogram.samples():
+                        lines.append(f'{metric}_bucket{{{labels},le="{bound}"}} {count}')
+                    lines.append(f'{metric}_sum{{{labels}}} {histogram.sum}')
+                    lines.append(f'{metric}_count{{{labels}}} {sum(histogram.counts)}')
+
+            metric = 'rideshare_sql_repeated_statements_total'
+            lines += [f'# HELP {metric} Requests or events that repeated one statement '
+                      f'more than {self.repeat_threshold} times.',
+                      f'# TYPE {metric} counter']
+            for (kind, endpoint), count in sorted(self._repeats.items()):
+                lines.append(f'{metric}{{kind="{kind}",endpoint="{endpoint}"}} {count}')
+        return '\n'.join(lines) + '\n'
+
+request_metrics = RequestMetrics()
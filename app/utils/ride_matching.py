@@ -1,9 +1,9 @@
 from datetime import datetime, timedelta
-from sqlalchemy import func
 from app import db
-from app.models.ride import Ride, RideRequest, Rating
+from app.models.ride import Ride, RideRequest
 from app.models.user import User
 from app.utils.distance import calculate_distance
+from app.utils.ratings import get_average_rating, get_average_ratings
 
 def get_ride_matches(user_id, start_lat, start_lon, end_lat, end_lon, departure_time, max_results=5):
     """
@@ -31,6 +31,9 @@ def get_ride_matches(user_id, start_lat, start_lon, end_lat, end_lon, departure_
     if not available_rides:
         return []
     
+    # Prefetch every candidate rider's rating in one query
+    rider_ratings = get_average_ratings(ride.rider_id for ride in available_rides)
+    
     # Calculate match scores for each ride
     scored_rides = []
     for ride in available_rides:
@@ -38,7 +41,8 @@ def get_ride_matches(user_id, start_lat, start_lon, end_lat, end_lon, departure_
             user, ride, 
             start_lat, start_lon, 
             end_lat, end_lon, 
-            departure_time
+            departure_time,
+            rider_ratings
         )
         scored_rides.append((ride, score))
     
@@ -46,10 +50,12 @@ def get_ride_matches(user_id, start_lat, start_lon, end_lat, end_lon, departure_
     scored_rides.sort(key=lambda x: x[1], reverse=True)
     return scored_rides[:max_results]
 
-def calculate_match_score(user, ride, start_lat, start_lon, end_lat, end_lon, preferred_time):
+def calculate_match_score(user, ride, start_lat, start_lon, end_lat, end_lon, preferred_time,
+                          rider_ratings=None):
     """
     Calculate a match score between a user and a ride based on multiple factors.
-    Higher score means better match.
+    Higher score means better match. rider_ratings is an optional prefetched
+    {rider_id: average rating} map from get_average_ratings.
     """
     # Base score
     score = 50.0
@@ -68,13 +74,15 @@ def calculate_match_score(user, ride, start_lat, start_lon, end_lat, end_lon, pr
     score += time_score * 30
     
     # 3. Rider rating (0-15 points)
-    rider = User.query.get(ride.rider_id)
-    avg_rating = get_user_average_rating(rider.id)
+    if rider_ratings is not None:
+        avg_rating = rider_ratings.get(ride.rider_id)
+    else:
+        avg_rating = get_user_average_rating(ride.rider_id)
     rating_score = avg_rating / 5.0 if avg_rating else 0.6  # Default to slightly above average if no ratings
     score += rating_score * 15
     
     # 4. Past ride history (0-15 points)
-    history_score = calculate_history_score(user.id, rider.id)
+    history_score = calculate_history_score(user.id, ride.rider_id)
     score += history_score * 15
     
     return score
@@ -148,11 +156,8 @@ def calculate_direction(start_lat, start_lon, end_lat, end_lon):
 
 def get_user_average_rating(user_id):
     """Get the average rating for a user"""
-    avg_rating = db.session.query(func.avg(Rating.rating)).filter(
-        Rating.to_user_id == user_id
-    ).scalar()
-    
-    return float(avg_rating) if avg_rating else None
+    # Read from the user's rating summary instead of averaging every rating
+    return get_average_rating(user_id)
 
 def calculate_history_score(user_id, rider_id):
     """
@@ -0,0 +1,134 @@
+import math
+from array import array
+
+class LocationHistory:
+    """
+    Bounded buffer of (timestamp, lat, lng) points for one trip.
+
+    Points are packed into a single array of doubles (24 bytes a point),
+    so memory per trip is bounded by capacity. When the buffer fills up
+    the recorded path is simplified in place down to at most half the
+    capacity, doubling the tolerance until it fits. Long trips therefore
+    keep their whole path, start included, at a coarser resolution.
+    """
+
+    def __init__(self, capacity=2048, tolerance=10):
+        self.capacity = max(capacity, 4)
+        self.tolerance = tolerance
+        self._data = array('d', bytes(self.capacity * 3 * 8))
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def append(self, timestamp, lat, lng):
+        if self._size == self.capacity:
+            self._compact()
+        index = self._size * 3
+        self._data[index:index + 3] = array('d', (timestamp, lat, lng))
+        self._size += 1
+
+    def _compact(self):
+        points = self.points()
+        while True:
+            kept = simplify(points, self.tolerance)
+            if len(kept) <= self.capacity // 2:
+                break
+            self.tolerance = self.tolerance * 2 or 1
+        for i, point in enumerate(kept):
+            self._data[i * 3:i * 3 + 3] = array('d', point)
+        self._size = len(kept)
+
+    def points(self):
+        """Get the stored points oldest first"""
+        data = self._data
+        return [(data[i], data[i + 1], data[i + 2]) for i in range(0, self._size * 3, 3)]
+
+def _offset_metres(point, origin):
+    """Project a (timestamp, lat, lng) point to metres east/north of an origin"""
+    x = math.radians(point[2] - origin[2]) * math.cos(math.radians(origin[1])) * 6371000
+    y = math.radians(point[1] - origin[1]) * 6371000
+    return x, y
+
+def _segment_distance(point, start, end):
+    """Distance in metres from a point to the segment start-end"""
+    px, py = _offset_metres(point, start)
+    ex, ey = _offset_metres(end, start)
+    length_squared = ex * ex + ey * ey
+    if length_squared == 0:
+        return math.hypot(px, py)
+    t = max(0, min(1, (px * ex + py * ey) / length_squared))
+    return math.hypot(px - t * ex, py - t * ey)
+
+def simplify(points, tolerance=10):
+    """
+    Downsample a path with Douglas-Peucker, keeping every point that is
+    more than tolerance metres off the simplified line. Points are
+    (timestamp, lat, lng) tuples; timestamps are kept with their points.
+    """
+    if len(points) < 3:
+        return list(points)
+
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        farthest, max_distance = None, tolerance
+        for i in range(first + 1, last):
+            distance = _segment_distance(points[i], points[first], points[last])
+            if distance > max_distance:
+                farthest, max_distance = i, distance
+        if farthest is not None:
+            keep[farthest] = True
+            stack.append((first, farthest))
+            stack.append((farthest, last))
+
+    return [point for point, kept in zip(points, keep) if kept]
+
+def _encode_value(value, output):
+    value = ~(value << 1) if value < 0 else value << 1
+    while value >= 0x20:
+        output.append(chr((0x20 | (value & 0x1f)) + 63))
+        value >>= 5
+    output.append(chr(value + 63))
+
+def encode_polyline(points, precision=5):
+    """
+    Encode (timestamp, lat, lng) points with the encoded polyline algorithm.
+    Each point stores lat, lng and whole seconds since the first point,
+    all as deltas from the previous point.
+    """
+    factor = 10 ** precision
+    output = []
+    if not points:
+        return ''
+
+    origin = points[0][0]
+    previous = (0, 0, 0)
+    for timestamp, lat, lng in points:
+        current = (round(lat * factor), round(lng * factor), round(timestamp - origin))
+        for value, last in zip(current, previous):
+            _encode_value(value - last, output)
+        previous = current
+    return ''.join(output)
+
+def decode_polyline(encoded, precision=5):
+    """Decode a polyline from encode_polyline into (seconds, lat, lng) points"""
+    factor = 10 ** precision
+    values, value, shift = [], 0, 0
+    for char in encoded:
+        chunk = ord(char) - 63
+        value |= (chunk & 0x1f) << shift
+        shift += 5
+        if chunk < 0x20:
+            values.append(~(value >> 1) if value & 1 else value >> 1)
+            value, shift = 0, 0
+
+    points, lat, lng, seconds = [], 0, 0, 0
+    for i in range(0, len(values) - 2, 3):
+        lat += values[i]
+        lng += values[i + 1]
+        seconds += values[i + 2]
+        points.append((seconds, lat / factor, lng / factor))
+    return points
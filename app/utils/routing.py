@@ -0,0 +1,114 @@
+import os
+import requests
+from flask import current_app
+from app.utils.disk_cache import DiskCache, TieredCache
+from app.utils.distance import calculate_distance
+
+class RoutingError(Exception):
+    pass
+
+class OSRMBackend:
+    """Driving routes from an OSRM server (a local one in production)"""
+
+    def __init__(self, base_url, timeout=5):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+
+    def route(self, from_lat, from_lng, to_lat, to_lng):
+        url = (f'{self.base_url}/route/v1/driving/'
+               f'{from_lng},{from_lat};{to_lng},{to_lat}')
+        try:
+            response = requests.get(url, params={'overview': 'full', 'geometries': 'geojson'},
+                                    timeout=self.timeout)
+            response.raise_for_status()
+            data = response.json()
+        except (requests.RequestException, ValueError) as e:
+            raise RoutingError(str(e)) from e
+
+        if data.get('code') != 'Ok' or not data.get('routes'):
+            raise RoutingError(data.get('message') or data.get('code') or 'No route found')
+
+        route = data['routes'][0]
+        return {
+            'distance': route['distance'],
+            'duration': route['duration'],
+            'geometry': route['geometry']
+        }
+
+class HaversineBackend:
+    """
+    Straight-line routes at an average speed. Needs no network, so it is
+    used for offline tests and as the fallback when OSRM is unavailable.
+    """
+
+    def __init__(self, speed_kmh=30, detour_factor=1.3):
+        self.speed_kmh = speed_kmh
+        self.detour_factor = detour_factor
+
+    def route(self, from_lat, from_lng, to_lat, to_lng):
+        distance_km = calculate_distance(from_lat, from_lng, to_lat, to_lng) * self.detour_factor
+        return {
+            'distance': round(distance_km * 1000, 1),
+            'duration': round(distance_km / self.speed_kmh * 3600, 1),
+            'geometry': {'type': 'LineString',
+                         'coordinates': [[from_lng, from_lat], [to_lng, to_lat]]}
+        }
+
+class RoutingService:
+    """
+    Routes and ETAs behind one interface, cached in memory and on disk.
+
+    Endpoints are snapped to a grid of `precision` decimal places (3 is
+    about 100 m) and the route is computed between the snapped points, so
+    every request inside the same pair of grid cells shares one cache
+    entry. Fallback routes are returned but not cached.
+    """
+
+    def __init__(self, backend, fallback=None, cache=None, precision=3):
+        self.backend = backend
+        self.fallback = fallback
+        self.cache = cache or TieredCache()
+        self.precision = precision
+
+    def get_route(self, from_lat, from_lng, to_lat, to_lng):
+        points = [round(value, self.precision) for value in (from_lat, from_lng, to_lat, to_lng)]
+        key = ','.join(f'{value:.{self.precision}f}' for value in points)
+
+        route = self.cache.get(key)
+        if route is not None:
+            return route
+
+        try:
+            route = self.backend.route(*points)
+        except RoutingError:
+            if self.fallback is None:
+                raise
+            current_app.logger.warning('Routing backend failed, using straight-line route')
+            return dict(self.fallback.route(*points), fallback=True)
+
+        self.cache.set(key, route)
+        return route
+
+def create_routing_service(app):
+    """Build the routing service described by the app config"""
+    fallback = HaversineBackend(app.config['ROUTING_AVERAGE_SPEED'])
+    if app.config['ROUTING_BACKEND'] == 'osrm':
+        # The public OSRM demo server is not for production traffic
+        if not app.config.get('ROUTING_OSRM_URL'):
+            raise RuntimeError('ROUTING_BACKEND=osrm needs ROUTING_OSRM_URL set to your OSRM server')
+        backend = OSRMBackend(app.config['ROUTING_OSRM_URL'])
+    else:
+        backend, fallback = fallback, None
+
+    cache_path = app.config.get('ROUTING_CACHE_PATH') or os.path.join(app.instance_path, 'route_cache.db')
+    disk = DiskCache(cache_path, table='route', max_age=app.config['ROUTING_CACHE_MAX_AGE'])
+    return RoutingService(backend, fallback,
+                          TieredCache(app.config['ROUTING_CACHE_SIZE'], disk),
+                          app.config['ROUTING_CACHE_PRECISION'])
+
+def get_route(from_lat, from_lng, to_lat, to_lng):
+    """Get a route dict (distance in m, duration in s, GeoJSON geometry) for the current app"""
+    service = current_app.extensions.get('routing')
+    if service is None:
+        service = current_app.extensions['routing'] = create_routing_service(current_app)
+    return service.get_route(from_lat, from_lng, to_lat, to_lng)
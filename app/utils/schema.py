@@ -0,0 +1,29 @@
+from sqlalchemy import inspect, text
+from app import db
+
+def add_missing_columns():
+    """
+    Add columns and indexes that were added to models after their tables
+    were first created. db.create_all() only creates missing tables, so
+    existing databases would otherwise fail on queries against new columns.
+    Only nullable columns (or columns with a server default) can be added.
+    """
+    inspector = inspect(db.engine)
+    existing_tables = set(inspector.get_table_names())
+    
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        
+        existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing_columns:
+                continue
+            column_type = column.type.compile(dialect=db.engine.dialect)
+            with db.engine.begin() as connection:
+                connection.execute(text(
+                    f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}'
+                ))
+        
+        for index in table.indexes:
+            index.create(bind=db.engine, checkfirst=True)
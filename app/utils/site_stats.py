@@ -0,0 +1,106 @@
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import event, exists, func, insert, inspect, literal, select, update
+from app import db
+from app.models.ride import Ride
+from app.models.stats import SiteStats
+from app.models.user import User
+
+STATS_ID = 1
+
+def _recount():
+    """(total users, total rides, active rides) as scalar subqueries"""
+    return (
+        select(func.count(User.id)).scalar_subquery(),
+        select(func.count(Ride.id)).scalar_subquery(),
+        select(func.count(Ride.id)).where(Ride.status == 'active').scalar_subquery(),
+    )
+
+def _ensure_stats_row(connection):
+    """Create the stats row from the user and ride tables if it does not exist yet"""
+    connection.execute(
+        insert(SiteStats.__table__).from_select(
+            ['id', 'total_users', 'total_rides', 'active_rides', 'reconciled_at'],
+            select(literal(STATS_ID), *_recount(), literal(datetime.utcnow(), db.DateTime)).where(
+                ~exists().where(SiteStats.id == STATS_ID)
+            )
+        )
+    )
+
+def _bump(connection, **deltas):
+    connection.execute(
+        update(SiteStats.__table__).where(SiteStats.id == STATS_ID).values({
+            name: getattr(SiteStats, name) + delta for name, delta in deltas.items() if delta
+        })
+    )
+
+def get_site_stats():
+    """
+    Get the landing page counters with a single-row read. Before the row
+    exists they are counted without writing. active_rides counts rides
+    with status 'active', so a ride past its departure time is included
+    until the ride sweep completes it (every RIDE_SWEEP_INTERVAL seconds).
+    """
+    stats = db.session.get(SiteStats, STATS_ID)
+    if stats is None:
+        total_users, total_rides, active_rides = db.session.execute(select(*_recount())).one()
+        stats = SiteStats(id=STATS_ID, total_users=total_users, total_rides=total_rides,
+                          active_rides=active_rides)
+    return stats
+
+def needs_reconcile(stats):
+    """True if the counters have not been recounted for SITE_STATS_RECONCILE_INTERVAL seconds"""
+    interval = timedelta(seconds=current_app.config.get('SITE_STATS_RECONCILE_INTERVAL', 300))
+    return stats.reconciled_at is None or datetime.utcnow() - stats.reconciled_at > interval
+
+def reconcile_site_stats():
+    """Recount the counters from the user and ride tables, correcting any drift"""
+    connection = db.session.connection()
+    _ensure_stats_row(connection)
+    total_users, total_rides, active_rides = _recount()
+    connection.execute(
+        update(SiteStats.__table__).where(SiteStats.id == STATS_ID).values(
+            total_users=total_users, total_rides=total_rides, active_rides=active_rides,
+            reconciled_at=datetime.utcnow()
+        )
+    )
+    db.session.commit()
+    return db.session.get(SiteStats, STATS_ID, populate_existing=True)
+
+@event.listens_for(User, 'before_insert')
+@event.listens_for(User, 'before_delete')
+@event.listens_for(Ride, 'before_insert')
+@event.listens_for(Ride, 'before_delete')
+def _before_counted_change(mapper, connection, target):
+    # Backfill from the tables before the row is written so it is counted once
+    _ensure_stats_row(connection)
+
+@event.listens_for(User, 'after_insert')
+def _user_added(mapper, connection, target):
+    _bump(connection, total_users=1)
+
+@event.listens_for(User, 'after_delete')
+def _user_deleted(mapper, connection, target):
+    _bump(connection, total_users=-1)
+
+@event.listens_for(Ride, 'after_insert')
+def _ride_added(mapper, connection, target):
+    _bump(connection, total_rides=1, active_rides=int((target.status or 'active') == 'active'))
+
+@event.listens_for(Ride, 'before_update')
+def _ride_status_changing(mapper, connection, target):
+    history = inspect(target).attrs.status.history
+    if not history.added:
+        return
+    # The row still holds the old status if it was not loaded before the change
+    old_status = history.deleted[0] if history.deleted else connection.execute(
+        select(Ride.status).where(Ride.id == target.id)
+    ).scalar()
+    active = int(history.added[0] == 'active') - int(old_status == 'active')
+    if active:
+        _ensure_stats_row(connection)
+        _bump(connection, active_rides=active)
+
+@event.listens_for(Ride, 'after_delete')
+def _ride_deleted(mapper, connection, target):
+    _bump(connection, total_rides=-1, active_rides=-int(target.status == 'active'))
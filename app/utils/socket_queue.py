@@ -0,0 +1,49 @@
+import queue
+from threading import Lock
+import socketio as python_socketio
+
+class InProcessManager(python_socketio.PubSubManager):
+    """
+    Socket.IO client manager that publishes through an in-process queue.
+
+    Stand-in for Redis when every "worker" lives in one process, such as
+    tests that run several SocketIO servers side by side. Managers on the
+    same channel all receive each published message, like Redis pub/sub.
+    """
+    name = 'inprocess'
+
+    _subscribers = {}
+    _subscribers_lock = Lock()
+
+    def __init__(self, url='memory://', channel='flask-socketio', write_only=False, logger=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self._inbox = queue.Queue()
+        if not write_only:
+            with self._subscribers_lock:
+                self._subscribers.setdefault(channel, []).append(self._inbox)
+
+    def _publish(self, data):
+        with self._subscribers_lock:
+            inboxes = list(self._subscribers.get(self.channel, []))
+        for inbox in inboxes:
+            inbox.put(data)
+
+    def _listen(self):
+        while True:
+            yield self._inbox.get()
+
+def socketio_options(app):
+    """
+    Keyword arguments for socketio.init_app() from the app config.
+    SOCKETIO_MESSAGE_QUEUE selects the shared pub/sub backend that lets
+    several workers deliver each other's emits: redis://... (needs the
+    redis package), kafka://, zmq+tcp://, any kombu URL, or memory:// for
+    the in-process stand-in.
+    """
+    url = app.config.get('SOCKETIO_MESSAGE_QUEUE')
+    channel = app.config.get('SOCKETIO_CHANNEL', 'flask-socketio')
+    if not url:
+        return {}
+    if url == 'memory://':
+        return {'client_manager': InProcessManager(url, channel=channel)}
+    return {'message_queue': url, 'channel': channel}
@@ -0,0 +1,146 @@
+import time
+from collections import OrderedDict
+from threading import Lock
+from uuid import uuid4
+from flask import current_app, request, session
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, make_transient_to_detached, object_session
+from app import db
+from app.models.user import User
+from app.utils.page_cache import MemoryBackend, page_cache
+
+# Columns kept in a snapshot; the password hash is left out and loaded on demand
+SNAPSHOT_COLUMNS = [column.key for column in inspect(User).column_attrs
+                    if column.key != 'password_hash']
+
+# Version of every user at once, changed by bulk updates and deletes
+ALL_USERS = '*'
+
+_snapshots = OrderedDict()
+_lock = Lock()
+
+# Versions live in the page cache backend so every worker sharing it sees a
+# change; with page caching off they fall back to this bounded per-process LRU
+_local_versions = MemoryBackend()
+
+def _version_backend():
+    return page_cache.backend or _local_versions
+
+def _version(user_id):
+    """
+    The user's snapshot version. A version that is missing (never set, or
+    evicted) is replaced by a new one, so stale snapshots never match it.
+    """
+    backend = _version_backend()
+    parts = []
+    for key in (f'user_version:{ALL_USERS}', f'user_version:{user_id}'):
+        version = backend.get(key)
+        if version is None:
+            version = uuid4().hex
+            backend.set(key, version)
+        parts.append(version)
+    return ':'.join(parts)
+
+def _snapshot(user):
+    return {key: getattr(user, key) for key in SNAPSHOT_COLUMNS}
+
+def _attach(snapshot):
+    """
+    Turn a snapshot into a User in the current session without a query.
+    Relationships and the password hash still load lazily on access.
+    """
+    user = User(**snapshot)
+    make_transient_to_detached(user)
+    return db.session.merge(user, load=False)
+
+def _get_snapshot(user_id, version):
+    with _lock:
+        entry = _snapshots.get(user_id)
+        if entry is None:
+            return None
+        expires_at, snapshot_version, snapshot = entry
+        if expires_at < time.monotonic() or snapshot_version != version:
+            del _snapshots[user_id]
+            return None
+        _snapshots.move_to_end(user_id)
+        return snapshot
+
+def _store_snapshot(user_id, version, snapshot):
+    ttl = current_app.config.get('USER_CACHE_TTL', 60)
+    size = current_app.config.get('USER_CACHE_SIZE', 4096)
+    _local_versions.size = size  # As many versions as snapshots
+    with _lock:
+        _snapshots[user_id] = (time.monotonic() + ttl, version, snapshot)
+        _snapshots.move_to_end(user_id)
+        while len(_snapshots) > size:
+            _snapshots.popitem(last=False)
+
+def invalidate_user(user_id=ALL_USERS):
+    """Make a user's (or every user's) snapshots and pinned socket identities stale"""
+    _version_backend().set(f'user_version:{user_id}', uuid4().hex)
+    with _lock:
+        if user_id == ALL_USERS:
+            _snapshots.clear()
+        else:
+            _snapshots.pop(user_id, None)
+
+def load_cached_user(user_id):
+    """
+    Load the logged-in user from a bounded TTL cache of column snapshots.
+
+    Socket.IO connections pin the identity resolved when they connected
+    on their connection session and reuse it for every event until the
+    user is changed, so long-lived sockets do not reload it per event.
+    """
+    # Read the version first so a change made while loading is not cached
+    version = _version(user_id)
+    socket_event = getattr(request, 'sid', None) is not None
+    if socket_event:
+        pinned = session.get('_identity')
+        if pinned and pinned[0] == user_id and pinned[1] == version:
+            return _attach(pinned[2])
+
+    snapshot = _get_snapshot(user_id, version)
+    if snapshot is not None:
+        user = _attach(snapshot)
+    else:
+        user = db.session.get(User, user_id)
+        if user is None:
+            return None
+        snapshot = _snapshot(user)
+        _store_snapshot(user_id, version, snapshot)
+
+    if socket_event:
+        session['_identity'] = (user_id, version, snapshot)
+    return user
+
+def _record_change(session, user_id):
+    session.info.setdefault('changed_users', set()).add(user_id)
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _user_changed(mapper, connection, target):
+    # Profile, role and password changes all go through an UPDATE of the row
+    session = object_session(target)
+    if session is not None:
+        _record_change(session, target.id)
+
+@event.listens_for(Session, 'do_orm_execute')
+def _bulk_user_change(orm_execute_state):
+    # query.update() and query.delete() skip the mapper events
+    if ((orm_execute_state.is_update or orm_execute_state.is_delete)
+            and orm_execute_state.bind_mapper is inspect(User)):
+        _record_change(orm_execute_state.session, ALL_USERS)
+
+# Invalidate once the change is visible, so a concurrent load cannot cache the old row
+@event.listens_for(Session, 'after_commit')
+def _invalidate_changed(session):
+    changed = session.info.pop('changed_users', None)
+    if not changed:
+        return
+    for user_id in (ALL_USERS,) if ALL_USERS in changed else changed:
+        invalidate_user(user_id)
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_changed(session):
+    session.info.pop('changed_users', None)
@@ -8,6 +8,23 @@ class Config:
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///rideshare.db'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     
+    # Database profile: 'default' keeps SQLite's rollback journal, 'production' turns on
+    # WAL and the SQLite pragmas below so readers are not blocked by a writer
+    DATABASE_PROFILE = os.environ.get('DATABASE_PROFILE', 'default')
+    DATABASE_POOL_SIZE = int(os.environ.get('DATABASE_POOL_SIZE', 10))
+    DATABASE_MAX_OVERFLOW = int(os.environ.get('DATABASE_MAX_OVERFLOW', 20))
+    DATABASE_POOL_TIMEOUT = float(os.environ.get('DATABASE_POOL_TIMEOUT', 30))  # seconds waiting for a connection
+    SQLITE_BUSY_TIMEOUT = int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000))  # milliseconds waiting for a lock
+    SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))  # bytes
+    SQLITE_CACHE_SIZE = int(os.environ.get('SQLITE_CACHE_SIZE', 64 * 1024))  # KiB of page cache per connection
+    
+    # Per-endpoint query counts and SQL time, served at /metrics. A warning is logged
+    # when one statement runs more than SQL_REPEAT_THRESHOLD times in a request or event
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'false').lower() in ['true', 'on', '1']
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')  # scrapers send it as 'Authorization: Bearer <token>'
+    METRICS_ALLOWED_IPS = os.environ.get('METRICS_ALLOWED_IPS', '127.0.0.1,::1')  # addresses or networks, comma-separated
+    SQL_REPEAT_THRESHOLD = int(os.environ.get('SQL_REPEAT_THRESHOLD', 10))
+    
     # Mail settings
     MAIL_SERVER = os.environ.get('MAIL_SERVER', 'smtp.gmail.com')
     MAIL_PORT = int(os.environ.get('MAIL_PORT', 587))
@@ -19,3 +36,84 @@ class Config:
     # Upload settings
     UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'app', 'static', 'uploads')
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
+    
+    # Chat write-behind: queue messages and commit them in small batches
+    CHAT_WRITE_BEHIND = os.environ.get('CHAT_WRITE_BEHIND', 'false').lower() in ['true', 'on', '1']
+    CHAT_BATCH_MAX_SIZE = int(os.environ.get('CHAT_BATCH_MAX_SIZE', 50))
+    CHAT_BATCH_MAX_DELAY = float(os.environ.get('CHAT_BATCH_MAX_DELAY', 0.05))  # seconds
+    
+    # Socket.IO message queue shared by all workers (e.g. redis://localhost:6379/0).
+    # Leave unset for a single process; memory:// is an in-process stand-in for tests
+    SOCKETIO_MESSAGE_QUEUE = os.environ.get('SOCKETIO_MESSAGE_QUEUE')
+    SOCKETIO_CHANNEL = os.environ.get('SOCKETIO_CHANNEL', 'flask-socketio')
+    
+    # Live location tracking: per-sender throttling and per-room broadcast rate
+    TRACKING_MIN_INTERVAL = float(os.environ.get('TRACKING_MIN_INTERVAL', 1.0))  # seconds
+    TRACKING_MIN_DISTANCE = float(os.environ.get('TRACKING_MIN_DISTANCE', 20))  # metres
+    TRACKING_BROADCASTS_PER_SECOND = float(os.environ.get('TRACKING_BROADCASTS_PER_SECOND', 2))
+    TRACKING_HISTORY_SIZE = int(os.environ.get('TRACKING_HISTORY_SIZE', 2048))  # points per trip before the path is simplified
+    TRACKING_SIMPLIFY_TOLERANCE = float(os.environ.get('TRACKING_SIMPLIFY_TOLERANCE', 10))  # metres
+    
+    # Routing and ETAs: 'osrm' (with a straight-line fallback) or 'haversine' for offline use
+    ROUTING_BACKEND = os.environ.get('ROUTING_BACKEND', 'haversine')  # or osrm
+    ROUTING_OSRM_URL = os.environ.get('ROUTING_OSRM_URL')  # your own OSRM server, required for osrm
+    ROUTING_AVERAGE_SPEED = float(os.environ.get('ROUTING_AVERAGE_SPEED', 30))  # km/h, straight-line ETAs
+    ROUTING_CACHE_SIZE = int(os.environ.get('ROUTING_CACHE_SIZE', 4096))  # routes kept in memory
+    ROUTING_CACHE_PRECISION = int(os.environ.get('ROUTING_CACHE_PRECISION', 3))  # decimals, ~100 m grid
+    ROUTING_CACHE_MAX_AGE = int(os.environ.get('ROUTING_CACHE_MAX_AGE', 7 * 24 * 3600))  # seconds
+    ROUTING_CACHE_PATH = os.environ.get('ROUTING_CACHE_PATH')  # defaults to instance/route_cache.db
+    
+    # Geocoding proxy: 'nominatim' or 'stub' for offline tests
+    GEOCODING_BACKEND = os.environ.get('GEOCODING_BACKEND', 'nominatim')
+    GEOCODING_NOMINATIM_URL = os.environ.get('GEOCODING_NOMINATIM_URL', 'https://nominatim.openstreetmap.org')
+    GEOCODING_USER_AGENT = os.environ.get('GEOCODING_USER_AGENT', 'RideShare/1.0')
+    GEOCODING_MIN_INTERVAL = float(os.environ.get('GEOCODING_MIN_INTERVAL', 1.0))  # seconds between upstream calls, per host
+    GEOCODING_MAX_WAIT = float(os.environ.get('GEOCODING_MAX_WAIT', 5.0))  # seconds a lookup may queue before failing
+    GEOCODING_CACHE_SIZE = int(os.environ.get('GEOCODING_CACHE_SIZE', 4096))  # lookups kept in memory
+    GEOCODING_CACHE_PRECISION = int(os.environ.get('GEOCODING_CACHE_PRECISION', 4))  # decimals, ~11 m grid
+    GEOCODING_CACHE_MAX_AGE = int(os.environ.get('GEOCODING_CACHE_MAX_AGE', 30 * 24 * 3600))  # seconds
+    GEOCODING_CACHE_PATH = os.environ.get('GEOCODING_CACHE_PATH')  # defaults to instance/geocode_cache.db
+    
+    # Page and fragment cache: 'memory' (per process), 'sqlite' (shared by the workers on
+    # one host), 'redis' (shared, needs the redis package and PAGE_CACHE_URL) or 'none'
+    PAGE_CACHE_BACKEND = os.environ.get('PAGE_CACHE_BACKEND', 'memory')
+    PAGE_CACHE_URL = os.environ.get('PAGE_CACHE_URL')  # e.g. redis://localhost:6379/1
+    PAGE_CACHE_PATH = os.environ.get('PAGE_CACHE_PATH')  # defaults to instance/page_cache.db
+    PAGE_CACHE_SIZE = int(os.environ.get('PAGE_CACHE_SIZE', 1024))  # entries kept by the memory backend
+    PAGE_CACHE_TIMEOUT = int(os.environ.get('PAGE_CACHE_TIMEOUT', 300))  # seconds
+    
+    # Green dashboard summaries (credits, carbon saved, leaderboard position) are cached this long
+    GREEN_SUMMARY_TTL = int(os.environ.get('GREEN_SUMMARY_TTL', 60))  # seconds
+    
+    # Rides past their departure time are completed by a background sweep this often (or by
+    # `flask rides sweep` from cron); until then they still count as active on the landing page
+    RIDE_SWEEP_INTERVAL = int(os.environ.get('RIDE_SWEEP_INTERVAL', 60))  # seconds
+    # Landing page counters are recounted by the sweep at least this often
+    SITE_STATS_RECONCILE_INTERVAL = int(os.environ.get('SITE_STATS_RECONCILE_INTERVAL', 300))  # seconds
+    
+    # Logged-in user snapshots kept in memory by the user loader. Their versions live in
+    # the page cache backend, so use 'sqlite' or 'redis' there when running several workers
+    USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 4096))
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', 60))  # seconds
+    
+    # Password hashing: 'scrypt', 'pbkdf2' or 'bcrypt'. The cost is scrypt N,
+    # pbkdf2 iterations or bcrypt log2 rounds; stored hashes are upgraded on login
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt')
+    PASSWORD_HASH_COST = int(os.environ['PASSWORD_HASH_COST']) if os.environ.get('PASSWORD_HASH_COST') else None
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', os.cpu_count() or 1))  # threads
+    
+    # Recency-weighted ratings: a rating counts half as much after this many days
+    RATING_HALF_LIFE_DAYS = float(os.environ.get('RATING_HALF_LIFE_DAYS', 90))
+    
+    # Profile pictures are resized on a background pool and served as immutable files
+    AVATAR_WORKERS = int(os.environ.get('AVATAR_WORKERS', 2))
+    AVATAR_CACHE_MAX_AGE = int(os.environ.get('AVATAR_CACHE_MAX_AGE', 365 * 24 * 3600))  # seconds
+    
+    # Outbound email workers: each keeps one SMTP connection and sends queued mail in batches
+    MAIL_WORKERS = int(os.environ.get('MAIL_WORKERS', 2))
+    MAIL_BATCH_SIZE = int(os.environ.get('MAIL_BATCH_SIZE', 20))
+    MAIL_QUEUE_MAX_SIZE = int(os.environ.get('MAIL_QUEUE_MAX_SIZE', 1000))
+    MAIL_MAX_RETRIES = int(os.environ.get('MAIL_MAX_RETRIES', 3))
+    MAIL_RETRY_DELAY = float(os.environ.get('MAIL_RETRY_DELAY', 1.0))  # seconds, doubled per retry
+    MAIL_IDLE_TIMEOUT = float(os.environ.get('MAIL_IDLE_TIMEOUT', 30))  # seconds before closing an idle connection
+    MAIL_SHUTDOWN_TIMEOUT = float(os.environ.get('MAIL_SHUTDOWN_TIMEOUT', 10))  # seconds to send queued mail at exit
@@ -0,0 +1,92 @@
+from datetime import datetime, timedelta
+import pytest
+from flask.testing import FlaskClient
+from config import Config
+from app import create_app, db
+from app.models.user import User
+from app.models.ride import Ride, RideRequest
+from app.utils.page_cache import page_cache, create_backend
+
+class ContextClient(FlaskClient):
+    """
+    Test client that handles each request in its own app context, so requests
+    get their own g and database session instead of sharing the test's
+    """
+
+    def open(self, *args, **kwargs):
+        with self.application.app_context():
+            return super().open(*args, **kwargs)
+
+@pytest.fixture(scope='session')
+def app(tmp_path_factory):
+    # One app per run: Socket.IO handlers are registered on the first app's server only
+    class TestConfig(Config):
+        TESTING = True
+        WTF_CSRF_ENABLED = False
+        SQLALCHEMY_DATABASE_URI = f'sqlite:///{tmp_path_factory.mktemp("db") / "test.db"}'
+        PAGE_CACHE_BACKEND = 'memory'
+        CHAT_WRITE_BEHIND = False
+        METRICS_ENABLED = False
+
+    app = create_app(TestConfig)
+    app.test_client_class = ContextClient
+    return app
+
+@pytest.fixture(autouse=True)
+def database(app):
+    """Fresh tables and caches for every test, with an app context pushed"""
+    with app.app_context():
+        db.create_all()
+        # Cached pages and user snapshot versions live in the page cache backend
+        page_cache.backend = create_backend(app)
+        yield
+        db.session.remove()
+        db.drop_all()
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+@pytest.fixture
+def make_user(app):
+    def make_user(username, role='traveler'):
+        user = User(username=username, email=f'{username}@example.com',
+                    phone_number='1234567890', role=role)
+        user.set_password('secret1')
+        db.session.add(user)
+        db.session.commit()
+        return user
+    return make_user
+
+@pytest.fixture
+def make_ride(app):
+    def make_ride(rider, status='active', **kwargs):
+        ride = Ride(rider_id=rider.id, start_location='A', end_location='B',
+                    start_latitude=12.9, start_longitude=77.5,
+                    end_latitude=13.3, end_longitude=77.9,
+                    departure_time=datetime.utcnow() + timedelta(days=1),
+                    available_seats=2, price=10, status=status, **kwargs)
+        db.session.add(ride)
+        db.session.commit()
+        return ride
+    return make_ride
+
+@pytest.fixture
+def chat(make_user, make_ride):
+    """An accepted ride request between a rider and a traveler: (request, rider, traveler)"""
+    rider = make_user('alice', 'rider')
+    traveler = make_user('bob')
+    ride = make_ride(rider)
+    ride_request = RideRequest(ride_id=ride.id, traveler_id=traveler.id, status='accepted')
+    db.session.add(ride_request)
+    db.session.commit()
+    return ride_request, rider, traveler
+
+@pytest.fixture
+def login():
+    """Log a test client in as a user"""
+    def login(client, user):
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user.id)
+            session['_fresh'] = True
+    return login
@@ -0,0 +1,75 @@
+import time
+from datetime import datetime
+import pytest
+from app import db, socketio
+from app.chat.writer import MessageBatchWriter
+from app.models.message import Message, UnreadCounter
+from app.models.notification import Notification
+
+@pytest.fixture
+def emitted(monkeypatch):
+    """Events emitted through Socket.IO, as (event, data, to) tuples"""
+    events = []
+    monkeypatch.setattr(socketio, 'emit', lambda event, data=None, to=None, **kwargs:
+                        events.append((event, data, to or kwargs.get('room'))))
+    return events
+
+def item(chat, number, **overrides):
+    ride_request, rider, traveler = chat
+    return dict({
+        'provisional_id': f'p{number}',
+        'ride_request_id': ride_request.id,
+        'sender_id': rider.id,
+        'sender_name': rider.username,
+        'recipient_id': traveler.id,
+        'content': f'm{number}',
+        'sid': 'rider-sid',
+        'link': f'/chat/chat/{ride_request.id}',
+        'created_at': datetime.utcnow()
+    }, **overrides)
+
+def test_messages_are_stored_in_queue_order(app, chat, emitted):
+    writer = MessageBatchWriter(max_size=3, max_delay=0.01)
+    for number in range(10):
+        writer.enqueue(app, item(chat, number))
+    writer.shutdown()
+
+    messages = Message.query.order_by(Message.id).all()
+    assert [message.content for message in messages] == [f'm{number}' for number in range(10)]
+    sent = [data for event, data, to in emitted if event == 'message_sent']
+    assert [data['provisional_id'] for data in sent] == [f'p{number}' for number in range(10)]
+    assert [data['id'] for data in sent] == [message.id for message in messages]
+    assert writer.pending() == 0
+
+def test_each_message_gets_an_inbox_entry_and_is_counted(app, chat, emitted):
+    ride_request, rider, traveler = chat
+    writer = MessageBatchWriter(max_size=50, max_delay=0.01)
+    for number in range(3):
+        writer.enqueue(app, item(chat, number))
+    writer.shutdown()
+
+    entries = Notification.query.filter_by(user_id=traveler.id).order_by(Notification.id).all()
+    assert [entry.message_id for entry in entries] == [message.id for message in
+                                                       Message.query.order_by(Message.id)]
+    assert db.session.get(UnreadCounter, traveler.id).unread_count == 3
+
+def test_a_full_batch_is_written_without_waiting_for_max_delay(app, chat, emitted):
+    writer = MessageBatchWriter(max_size=2, max_delay=30)
+    writer.enqueue(app, item(chat, 0))
+    writer.enqueue(app, item(chat, 1))
+    deadline = time.monotonic() + 5
+    while Message.query.count() < 2 and time.monotonic() < deadline:
+        time.sleep(0.05)
+        db.session.rollback()
+    assert Message.query.count() == 2
+    writer.shutdown()
+
+def test_a_failed_batch_is_reported_and_later_batches_still_written(app, chat, emitted):
+    writer = MessageBatchWriter()
+    writer.flush([item(chat, 0), item(chat, 1, ride_request_id=None)])
+    writer.flush([item(chat, 2)])
+
+    failed = [data['provisional_id'] for event, data, to in emitted if event == 'message_failed']
+    assert failed == ['p0', 'p1']
+    assert [message.content for message in Message.query] == ['m2']
+    assert Notification.query.count() == 1
@@ -0,0 +1,92 @@
+from app import db
+from app.models.green_credits import GreenCredit, CreditRedemption, CreditBalance
+from app.utils.credits import get_balance, redeem, rebuild_balances
+
+def earn(user, amount):
+    db.session.add(GreenCredit(user_id=user.id, amount=amount, reason='Test credit'))
+    db.session.commit()
+
+def test_credits_update_the_balance_row(make_user):
+    user = make_user('alice')
+    earn(user, 30)
+    earn(user, 20)
+    assert db.session.get(CreditBalance, user.id).balance == 50
+
+def test_balance_without_a_row_is_read_from_the_ledger(make_user):
+    user = make_user('alice')
+    db.session.add(GreenCredit(user_id=user.id, amount=40, reason='Test credit'))
+    db.session.flush()
+    CreditBalance.query.delete()
+    assert get_balance(user.id) == 40
+    assert db.session.get(CreditBalance, user.id) is None
+
+def test_redeem_debits_the_balance(make_user):
+    user = make_user('alice')
+    earn(user, 120)
+    redemption, created = redeem(user.id, 50, 'discount', '')
+    assert created
+    assert redemption.id is not None
+    assert get_balance(user.id) == 70
+
+def test_redeem_without_enough_credits_debits_nothing(make_user):
+    user = make_user('alice')
+    earn(user, 40)
+    redemption, created = redeem(user.id, 50, 'discount', '')
+    db.session.rollback()
+    assert (redemption, created) == (None, False)
+    assert get_balance(user.id) == 40
+    assert CreditRedemption.query.count() == 0
+
+def test_redeem_cannot_overdraw_with_repeated_debits(make_user):
+    user = make_user('alice')
+    earn(user, 120)
+    results = [redeem(user.id, 50, 'discount', '')[1] for _ in range(3)]
+    db.session.rollback()
+    assert results == [True, True, False]
+    assert get_balance(user.id) == 20
+
+def test_redeem_with_the_same_key_applies_once(make_user):
+    user = make_user('alice')
+    earn(user, 200)
+    first, created = redeem(user.id, 50, 'discount', '', idempotency_key='k1')
+    retry, retried = redeem(user.id, 50, 'discount', '', idempotency_key='k1')
+    assert created and not retried
+    assert retry.id == first.id
+    assert get_balance(user.id) == 150
+    assert CreditRedemption.query.count() == 1
+
+def test_idempotency_keys_are_per_user(make_user):
+    alice, bob = make_user('alice'), make_user('bob')
+    earn(alice, 100)
+    earn(bob, 100)
+    assert redeem(alice.id, 50, 'discount', '', idempotency_key='k1')[1]
+    assert redeem(bob.id, 50, 'discount', '', idempotency_key='k1')[1]
+    assert get_balance(alice.id) == get_balance(bob.id) == 50
+
+def test_deleting_a_redemption_refunds_it(make_user):
+    user = make_user('alice')
+    earn(user, 100)
+    redemption, _ = redeem(user.id, 50, 'discount', '')
+    db.session.delete(redemption)
+    db.session.commit()
+    assert get_balance(user.id) == 100
+
+def test_rebuild_balances_matches_the_ledger(make_user):
+    user = make_user('alice')
+    earn(user, 100)
+    redeem(user.id, 75, 'priority', '')
+    db.session.get(CreditBalance, user.id).balance = 999
+    db.session.commit()
+    rebuild_balances()
+    db.session.commit()
+    assert get_balance(user.id) == 25
+
+def test_redeem_form_resubmission_is_applied_once(client, make_user, login):
+    user = make_user('alice')
+    earn(user, 100)
+    login(client, user)
+    form = {'reward_type': 'discount', 'amount': '50', 'idempotency_key': 'form-1'}
+    client.post('/green/redeem', data=form)
+    client.post('/green/redeem', data=form)
+    assert CreditRedemption.query.count() == 1
+    assert get_balance(user.id) == 50
@@ -0,0 +1,80 @@
+from sqlalchemy import update
+from app import db, socketio
+from app.models.message import Message, ChatReadState
+from app.models.notification import Notification
+from app.utils.read_state import backfill_notifications, mark_notifications_read, mark_read
+
+def inbox(client):
+    return client.get('/chat/api/notifications').get_json()['notifications']
+
+def test_sent_message_is_in_the_inbox_until_the_chat_is_opened(app, chat, login):
+    ride_request, rider, traveler = chat
+    rider_client, traveler_client = app.test_client(), app.test_client()
+    login(rider_client, rider)
+    login(traveler_client, traveler)
+
+    socket = socketio.test_client(app, flask_test_client=rider_client)
+    socket.emit('join', {'room': f'chat_{ride_request.id}'})
+    socket.emit('message', {'request_id': ride_request.id, 'message': 'hello'})
+
+    entry = Notification.query.filter_by(user_id=traveler.id, type='message').one()
+    message = Message.query.one()
+    assert entry.message_id == message.id
+    assert [item['type'] for item in inbox(traveler_client)] == ['message']
+
+    traveler_client.get(f'/chat/chat/{ride_request.id}')
+    assert inbox(traveler_client) == []
+    socket.disconnect()
+
+def message_with_entry(ride_request, sender, recipient):
+    message = Message(ride_request_id=ride_request.id, sender_id=sender.id, content='hi')
+    db.session.add(message)
+    db.session.flush()
+    db.session.add(Notification(user_id=recipient.id, type='message', message='New message',
+                                ride_request_id=ride_request.id, message_id=message.id,
+                                created_at=message.created_at))
+    db.session.commit()
+    return message.id
+
+def test_reading_part_of_a_chat_keeps_later_entries_unread(chat):
+    ride_request, rider, traveler = chat
+    ids = [message_with_entry(ride_request, rider, traveler) for _ in range(3)]
+    mark_read(ride_request.id, traveler.id, ids[1])
+    db.session.commit()
+    unread = Notification.query.filter_by(user_id=traveler.id, is_read=False).all()
+    assert [entry.message_id for entry in unread] == [ids[2]]
+
+def test_entries_are_marked_read_by_type(chat):
+    ride_request, rider, traveler = chat
+    message_with_entry(ride_request, rider, traveler)
+    db.session.add(Notification(user_id=traveler.id, type='ride', message='Request accepted'))
+    db.session.commit()
+    assert mark_notifications_read(traveler.id, 'ride') == 1
+    db.session.commit()
+    assert [entry.type for entry in Notification.query.filter_by(is_read=False)] == ['message']
+
+def test_backfill_sets_read_state_and_adds_missing_entries(chat):
+    ride_request, rider, traveler = chat
+    read_id = message_with_entry(ride_request, traveler, rider)
+    db.session.add(ChatReadState(ride_request_id=ride_request.id, user_id=rider.id,
+                                 last_read_message_id=read_id))
+    db.session.add(Notification(user_id=traveler.id, type='ride', message='Request accepted'))
+    unread = [Message(ride_request_id=ride_request.id, sender_id=rider.id, content=f'm{i}')
+              for i in range(2)]
+    db.session.add_all(unread)
+    db.session.commit()
+    # Entries from before the inbox tracked read state
+    db.session.execute(update(Notification).values(is_read=None))
+    db.session.commit()
+
+    assert backfill_notifications() == 2
+    assert backfill_notifications() == 0
+
+    entries = {(entry.user_id, entry.type, entry.message_id): entry.is_read
+               for entry in Notification.query}
+    assert entries == {
+        (rider.id, 'message', read_id): True,
+        (traveler.id, 'ride', None): False,
+        (traveler.id, 'message', unread[0].id): False,
+        (traveler.id, 'message', unread[1].id): False,
+    }
@@ -0,0 +1,60 @@
+import pytest
+from app import db
+from app.models.green_credits import GreenCredit
+from app.utils.page_cache import page_cache
+
+@pytest.fixture
+def renders():
+    """Render a fragment under tags, returning how many times it was rendered so far"""
+    counts = {}
+    def render(name, *tags):
+        def render_fragment():
+            counts[name] = counts.get(name, 0) + 1
+            return name
+        page_cache.fragment([name], tags, None, render_fragment)
+        return counts[name]
+    return render
+
+def test_fragments_are_cached_until_a_tag_is_invalidated(renders):
+    assert renders('top', 'users', 'credits') == 1
+    assert renders('top', 'users', 'credits') == 1
+    page_cache.invalidate('credits')
+    assert renders('top', 'users', 'credits') == 2
+
+def test_committed_changes_invalidate_their_model_tags(make_user, renders):
+    user = make_user('alice')
+    renders('users', 'users')
+    renders('credits', 'credits')
+    db.session.add(GreenCredit(user_id=user.id, amount=10, reason='Test credit'))
+    db.session.commit()
+    assert renders('users', 'users') == 1
+    assert renders('credits', 'credits') == 2
+
+def test_rolled_back_changes_do_not_invalidate(make_user, renders):
+    user = make_user('alice')
+    renders('credits', 'credits')
+    db.session.add(GreenCredit(user_id=user.id, amount=10, reason='Test credit'))
+    db.session.flush()
+    db.session.rollback()
+    assert renders('credits', 'credits') == 1
+
+def test_only_displayed_user_columns_invalidate_users(make_user, renders):
+    user = make_user('alice')
+    renders('users', 'users')
+    user.set_password('another1')
+    db.session.commit()
+    assert renders('users', 'users') == 1
+    user.username = 'alice2'
+    db.session.commit()
+    assert renders('users', 'users') == 2
+
+def test_anonymous_pages_are_served_from_the_cache(client, make_user, login):
+    user = make_user('alice')
+    assert client.get('/green/leaderboard').headers['X-Cache'] == 'MISS'
+    assert client.get('/green/leaderboard').headers['X-Cache'] == 'HIT'
+    db.session.add(GreenCredit(user_id=user.id, amount=10, reason='Test credit'))
+    db.session.commit()
+    assert client.get('/green/leaderboard').headers['X-Cache'] == 'MISS'
+
+    login(client, user)
+    assert 'X-Cache' not in client.get('/green/leaderboard').headers
@@ -0,0 +1,120 @@
+from sqlalchemy import event, update
+from app import db
+from app.models.message import Message, ChatReadState, UnreadCounter
+from app.utils.read_state import get_last_read, get_unread_count, get_unread_total, mark_read
+
+def send(ride_request, sender, count=1):
+    messages = [Message(ride_request_id=ride_request.id, sender_id=sender.id, content=f'm{i}')
+                for i in range(count)]
+    db.session.add_all(messages)
+    db.session.commit()
+    return [message.id for message in messages]
+
+def test_mark_read_defaults_to_the_latest_message(chat):
+    ride_request, rider, traveler = chat
+    ids = send(ride_request, rider, 3)
+    assert mark_read(ride_request.id, traveler.id)
+    db.session.commit()
+    assert get_last_read(ride_request.id, traveler.id) == ids[-1]
+    assert get_unread_count(ride_request.id, traveler.id) == 0
+
+def test_mark_read_without_messages_does_nothing(chat):
+    ride_request, rider, traveler = chat
+    assert not mark_read(ride_request.id, traveler.id)
+    assert ChatReadState.query.count() == 0
+
+def test_watermark_never_moves_backwards(chat):
+    ride_request, rider, traveler = chat
+    ids = send(ride_request, rider, 3)
+    assert mark_read(ride_request.id, traveler.id, ids[2])
+    assert not mark_read(ride_request.id, traveler.id, ids[0])
+    assert not mark_read(ride_request.id, traveler.id, ids[2])
+    db.session.commit()
+    assert get_last_read(ride_request.id, traveler.id) == ids[2]
+
+def test_watermarks_are_per_participant(chat):
+    ride_request, rider, traveler = chat
+    send(ride_request, rider, 2)
+    send(ride_request, traveler, 1)
+    mark_read(ride_request.id, traveler.id)
+    db.session.commit()
+    assert get_unread_count(ride_request.id, traveler.id) == 0
+    assert get_unread_count(ride_request.id, rider.id) == 1
+
+def test_concurrent_move_is_retried_from_the_new_watermark(app, chat):
+    ride_request, rider, traveler = chat
+    ids = send(ride_request, rider, 4)
+    mark_read(ride_request.id, traveler.id, ids[0])
+    db.session.commit()
+
+    # Another reader moves the watermark between our read and our compare-and-set
+    moved = []
+    def concurrent_reader(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith('UPDATE chat_read_state') and not moved:
+            moved.append(True)
+            with db.engine.begin() as other:
+                other.execute(update(ChatReadState).values(last_read_message_id=ids[2]))
+    event.listen(db.engine, 'before_cursor_execute', concurrent_reader)
+    try:
+        assert mark_read(ride_request.id, traveler.id, ids[3])
+        db.session.commit()
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', concurrent_reader)
+
+    assert moved
+    assert get_last_read(ride_request.id, traveler.id) == ids[3]
+    # Only the message past the other reader's watermark was counted by this call
+    assert db.session.get(UnreadCounter, traveler.id).unread_count == 2
+
+def unread_total(user):
+    counter = db.session.get(UnreadCounter, user.id)
+    return counter.unread_count if counter else None
+
+def test_messages_count_for_the_recipient_only(chat):
+    ride_request, rider, traveler = chat
+    send(ride_request, rider, 3)
+    send(ride_request, traveler, 1)
+    assert unread_total(traveler) == 3
+    assert unread_total(rider) == 1
+
+def test_messages_flushed_together_are_counted_once_each(chat):
+    ride_request, rider, traveler = chat
+    send(ride_request, rider, 25)
+    assert unread_total(traveler) == 25
+
+def test_counter_row_is_built_from_existing_history(chat):
+    ride_request, rider, traveler = chat
+    send(ride_request, rider, 3)
+    mark_read(ride_request.id, traveler.id)
+    send(ride_request, rider, 2)
+    UnreadCounter.query.delete()
+    db.session.commit()
+
+    send(ride_request, rider, 1)
+    assert unread_total(traveler) == 3
+
+def test_reading_decrements_the_counter(chat):
+    ride_request, rider, traveler = chat
+    ids = send(ride_request, rider, 4)
+    mark_read(ride_request.id, traveler.id, ids[1])
+    db.session.commit()
+    assert unread_total(traveler) == 2
+    mark_read(ride_request.id, traveler.id)
+    db.session.commit()
+    assert unread_total(traveler) == 0
+
+def test_counter_never_goes_negative(chat):
+    ride_request, rider, traveler = chat
+    send(ride_request, rider, 3)
+    db.session.execute(update(UnreadCounter).values(unread_count=1))
+    mark_read(ride_request.id, traveler.id)
+    db.session.commit()
+    assert unread_total(traveler) == 0
+
+def test_unread_total_without_a_row_does_not_write(chat):
+    ride_request, rider, traveler = chat
+    send(ride_request, rider, 2)
+    UnreadCounter.query.delete()
+    db.session.commit()
+    assert get_unread_total(traveler.id) == 2
+    assert UnreadCounter.query.count() == 0
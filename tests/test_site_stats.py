@@ -0,0 +1,63 @@
+from datetime import datetime, timedelta
+from sqlalchemy import update
+from app import db
+from app.models.stats import SiteStats
+from app.utils.site_stats import STATS_ID, get_site_stats, needs_reconcile, reconcile_site_stats
+
+def counters():
+    stats = get_site_stats()
+    return stats.total_users, stats.total_rides, stats.active_rides
+
+def test_counts_without_a_row_are_read_from_the_tables(make_user, make_ride):
+    rider = make_user('alice', 'rider')
+    make_ride(rider)
+    SiteStats.query.delete()
+    db.session.commit()
+    assert counters() == (1, 1, 1)
+    assert SiteStats.query.count() == 0
+
+def test_new_users_and_rides_are_counted_once(make_user, make_ride):
+    rider = make_user('alice', 'rider')
+    make_user('bob')
+    make_ride(rider)
+    make_ride(rider, status='completed')
+    assert counters() == (2, 2, 1)
+    assert db.session.get(SiteStats, STATS_ID) is not None
+
+def test_status_changes_move_the_active_count(make_user, make_ride):
+    rider = make_user('alice', 'rider')
+    ride = make_ride(rider)
+    ride.status = 'completed'
+    db.session.commit()
+    assert counters() == (1, 1, 0)
+
+    # Changed without the old status loaded
+    db.session.expire(ride, ['status'])
+    ride.status = 'active'
+    db.session.commit()
+    assert counters() == (1, 1, 1)
+
+    ride.available_seats = 1
+    db.session.commit()
+    assert counters() == (1, 1, 1)
+
+def test_deletes_are_counted(make_user, make_ride):
+    rider = make_user('alice', 'rider')
+    other = make_user('bob')
+    ride = make_ride(rider)
+    db.session.delete(ride)
+    db.session.delete(other)
+    db.session.commit()
+    assert counters() == (1, 0, 0)
+
+def test_reconcile_corrects_drift(app, make_user, make_ride):
+    rider = make_user('alice', 'rider')
+    make_ride(rider)
+    db.session.execute(update(SiteStats).values(total_users=40, active_rides=-3,
+                                                reconciled_at=datetime.utcnow() - timedelta(days=1)))
+    db.session.commit()
+    assert needs_reconcile(get_site_stats())
+
+    stats = reconcile_site_stats()
+    assert (stats.total_users, stats.total_rides, stats.active_rides) == (1, 1, 1)
+    assert not needs_reconcile(stats)